@@ -1,14 +1,31 @@
 # core/admin.py
 
+import csv
+
 from django.contrib import admin
+from django.http import StreamingHttpResponse
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 
+from .forms import CachedModelChoiceField
+
 # Importamos todos los modelos de nuestra app 'core'
 from .models import (
     Usuario, CategoriaProducto, Producto, Mesa, 
     Orden, OrdenProducto, Factura
 )
+from .utils import notificar_cambio_cocina
+
+
+class Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en vez de guardarla."""
+    def write(self, value):
+        return value
+
+
+def es_changelist(request):
+    """Indica si la request es la lista de cambios del admin (no el formulario)."""
+    return bool(request.resolver_match) and (request.resolver_match.url_name or '').endswith('_changelist')
 
 
 # --- Formularios Personalizados para el Modelo Usuario ---
@@ -60,6 +77,10 @@ class CustomUserAdmin(UserAdmin):
     )
     readonly_fields = ('last_login', 'creado_en')
 
+    def get_queryset(self, request):
+        # El hash de la contraseña no se muestra en la lista; se carga solo si se necesita
+        return super().get_queryset(request).defer('password')
+
 @admin.register(CategoriaProducto)
 class CategoriaProductoAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'descripcion', 'is_active')
@@ -69,10 +90,25 @@ class CategoriaProductoAdmin(admin.ModelAdmin):
 @admin.register(Producto)
 class ProductoAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'id_categoria', 'precio', 'cantidad', 'is_available', 'is_active')
+    list_select_related = ('id_categoria',)
     list_filter = ('is_available', 'is_active', 'id_categoria')
     search_fields = ('nombre', 'descripcion')
     list_editable = ('precio', 'cantidad', 'is_available')
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if es_changelist(request):
+            # La lista no muestra descripcion ni imagen_url: no los traemos
+            queryset = queryset.only(
+                'nombre', 'id_categoria', 'precio', 'cantidad', 'is_available', 'is_active', 'id_categoria__nombre'
+            )
+        return queryset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'id_categoria':
+            kwargs['form_class'] = CachedModelChoiceField
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 @admin.register(Mesa)
 class MesaAdmin(admin.ModelAdmin):
     list_display = ('numero', 'ubicacion', 'capacidad', 'estado', 'is_active')
@@ -87,18 +123,111 @@ class OrdenProductoInline(admin.TabularInline):
     model = OrdenProducto
     extra = 1
     readonly_fields = ('precio_unitario',)
+    # Solo se carga el producto seleccionado; el resto llega por búsqueda AJAX
+    autocomplete_fields = ('producto',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('producto')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # El desplegable solo necesita el nombre del producto (Producto.__str__)
+        if db_field.name == 'producto':
+            kwargs['queryset'] = Producto.objects.only('id', 'nombre')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 @admin.register(Orden)
 class OrdenAdmin(admin.ModelAdmin):
     list_display = ('id', 'mesa', 'mesero', 'estado', 'creado_en')
+    list_select_related = ('mesa', 'mesero')
     list_filter = ('estado', 'mesa', 'mesero')
-    search_fields = ('id', 'mesa__numero', 'mesero__nombre')
+    search_fields = ('mesa__numero', 'mesero__nombre')
     readonly_fields = ('creado_en', 'confirmado_en', 'enviado_cocina_en', 'listo_en')
+    # Los usuarios se guardan en cada login (last_login): no sirven para un desplegable cacheado
+    autocomplete_fields = ('mesero',)
     inlines = [OrdenProductoInline]
 
+    def get_queryset(self, request):
+        # Mesa y mesero se usan en la lista y en __str__, los traemos con JOIN
+        queryset = super().get_queryset(request).select_related('mesa', 'mesero')
+        if es_changelist(request):
+            # En la lista solo se pintan estas columnas (observaciones es TEXT)
+            queryset = queryset.only('mesa', 'mesero', 'estado', 'creado_en', 'mesa__numero', 'mesero__email')
+        return queryset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Las mesas cambian poco: su desplegable sale de cache
+        if db_field.name == 'mesa':
+            kwargs['form_class'] = CachedModelChoiceField
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Buscar por id como texto obliga a recorrer toda la tabla;
+        # si el término es numérico lo buscamos por clave primaria exacta.
+        base_queryset = queryset
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term.strip().isdigit():
+            queryset |= base_queryset.filter(pk=int(search_term))
+        return queryset, may_have_duplicates
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not OrdenProducto:
+            return super().save_formset(request, form, formset, change)
+
+        # Las filas nuevas se guardan una a una: el admin necesita su pk para el historial
+        # y MySQL no la devuelve en bulk_create; además así disparan post_save.
+        # Las modificadas sí van en un solo UPDATE en lote.
+        instances = formset.save(commit=False)
+        to_update = []
+        for instance in instances:
+            if instance.precio_unitario is None:
+                instance.precio_unitario = instance.producto.precio
+            if instance.pk:
+                to_update.append(instance)
+            else:
+                instance.save()
+
+        if to_update:
+            OrdenProducto.objects.bulk_update(
+                to_update, ['producto', 'cantidad', 'precio_unitario', 'estado', 'observaciones'], batch_size=500
+            )
+            # bulk_update no dispara post_save: avisar a la cocina explícitamente
+            notificar_cambio_cocina()
+        for obj in formset.deleted_objects:
+            obj.delete()
+        formset.save_m2m()
+
 @admin.register(Factura)
 class FacturaAdmin(admin.ModelAdmin):
     list_display = ('id', 'orden', 'total', 'estado_pago', 'creado_en')
+    list_select_related = ('orden',)
     list_filter = ('estado_pago',)
     search_fields = ('orden__id',)
-    readonly_fields = ('creado_en', 'pagado_en', 'subtotal', 'total')
\ No newline at end of file
+    readonly_fields = ('creado_en', 'pagado_en', 'subtotal', 'total')
+    actions = ['exportar_facturas_csv']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if es_changelist(request):
+            queryset = queryset.only('orden', 'total', 'estado_pago', 'creado_en', 'orden__id')
+        return queryset
+
+    @admin.action(description='Exportar facturas seleccionadas a CSV')
+    def exportar_facturas_csv(self, request, queryset):
+        # Se recorre con un cursor por bloques para no cargar todas las facturas en memoria
+        facturas = queryset.select_related(None).only(
+            'id', 'numero_factura', 'orden', 'total', 'estado_pago', 'metodo_pago', 'creado_en'
+        ).order_by('id').iterator(chunk_size=2000)
+
+        writer = csv.writer(Echo())
+
+        def filas():
+            yield writer.writerow(['id', 'numero_factura', 'orden', 'total', 'estado_pago', 'metodo_pago', 'creado_en'])
+            for factura in facturas:
+                yield writer.writerow([
+                    factura.id, factura.numero_factura or '', factura.orden_id, factura.total,
+                    factura.estado_pago, factura.metodo_pago or '', factura.creado_en.isoformat(),
+                ])
+
+        response = StreamingHttpResponse(filas(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="facturas.csv"'
+        return response
@@ -3,18 +3,49 @@
 from django.shortcuts import redirect
 
 
+import math
 import time
-import hashlib
+import xxhash
 from functools import wraps
 from django.http import JsonResponse
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.utils.connection import ConnectionProxy
 from django.contrib.auth.decorators import login_required
+from django.db import DatabaseError
+from .utils import cache_compartida
 import json
 
+# Tiempo (segundos) que se cachean los grupos de cada usuario. La invalidación por
+# m2m_changed solo llega a todos los workers con cache compartida (Redis); con la
+# cache local de cada proceso un cambio de rol debe aplicarse casi de inmediato.
+GROUPS_CACHE_TIME = 60
+GROUPS_CACHE_TIME_LOCAL = 5
+
+def user_groups_cache_key(user_id):
+    """Clave de cache con los nombres de grupo de un usuario."""
+    return f"user_groups_{user_id}"
+
+def get_user_group_names(request):
+    """
+    Devuelve el conjunto de nombres de grupo del usuario de la request.
+    Se guarda en la propia request y en cache para no consultar la BD en cada vista.
+    """
+    if not hasattr(request, '_group_names'):
+        cache_key = user_groups_cache_key(request.user.id)
+        names = cache.get(cache_key)
+        if names is None:
+            names = frozenset(request.user.groups.values_list('name', flat=True))
+            timeout = GROUPS_CACHE_TIME if cache_compartida() else GROUPS_CACHE_TIME_LOCAL
+            cache.set(cache_key, names, timeout=timeout)
+        request._group_names = names
+    return request._group_names
+
 def group_required(allowed_groups=[]):
     """
     Decorador que verifica si un usuario pertenece a uno de los grupos permitidos.
     """
+    allowed = frozenset(allowed_groups)
+
     def decorator(view_func):
         def wrapper(request, *args, **kwargs):
             # 1. Si el usuario no está autenticado, lo enviamos al login.
@@ -26,7 +57,7 @@ def group_required(allowed_groups=[]):
                 return view_func(request, *args, **kwargs)
 
             # 3. Si el usuario pertenece a alguno de los grupos en la lista, le damos acceso.
-            if request.user.groups.filter(name__in=allowed_groups).exists():
+            if not allowed.isdisjoint(get_user_group_names(request)):
                 return view_func(request, *args, **kwargs)
             else:
                 # 4. Si no cumple ninguna condición, no tiene permiso.
@@ -37,46 +68,69 @@ def group_required(allowed_groups=[]):
 
 # core/decorators.py - AGREGAR ESTAS NUEVAS FUNCIONES AL ARCHIVO EXISTENTE
 
-import time
-import hashlib
-from functools import wraps
-from django.http import JsonResponse
-from django.core.cache import cache
-from django.contrib.auth.decorators import login_required
-import json
-
 # === CONFIGURACIÓN DEL SISTEMA DE DEBOUNCE ===
-DEBOUNCE_CONFIG = {
-    'DEFAULT_DELAY': 0.5,      # 500ms por defecto
-    'CRITICAL_DELAY': 2.0,     # 2 segundos para operaciones críticas
-    'FORM_DELAY': 1.0,         # 1 segundo para formularios
-    'MAX_CACHE_TIME': 300,     # 5 minutos máximo en cache
-    'CACHE_PREFIX': 'debounce_'
-}
+# Cache local del proceso (ver CACHES['debounce'] en settings)
+debounce_cache = ConnectionProxy(caches, 'debounce')
+
+DEBOUNCE_DEFAULT_DELAY = 0.5      # 500ms por defecto
+DEBOUNCE_CRITICAL_DELAY = 2.0     # 2 segundos para operaciones críticas
+DEBOUNCE_FORM_DELAY = 1.0         # 1 segundo para formularios
+DEBOUNCE_CACHE_PREFIX = 'debounce_'
 
 def generate_debounce_key(user_id, view_name, request_data=None):
     """
     Genera una clave única para el debounce basada en:
     - ID del usuario
     - Nombre de la vista
-    - Datos de la request (opcional)
+    - Datos de la request (opcional, bytes crudos del body o un dict)
     """
     base_string = f"{user_id}:{view_name}"
     
     if request_data:
-        # Crear hash de los datos para incluir en la clave
-        data_string = json.dumps(request_data, sort_keys=True)
-        data_hash = hashlib.md5(data_string.encode()).hexdigest()[:8]
-        base_string += f":{data_hash}"
+        # Hash de los datos para incluir en la clave. Los bytes del body se
+        # hashean directamente, sin pasar por json.loads/json.dumps.
+        if not isinstance(request_data, bytes):
+            request_data = json.dumps(request_data, sort_keys=True).encode()
+        base_string += f":{xxhash.xxh3_64_hexdigest(request_data)}"
     
-    return f"{DEBOUNCE_CONFIG['CACHE_PREFIX']}{base_string}"
+    return f"{DEBOUNCE_CACHE_PREFIX}{base_string}"
+
+def acquire_debounce(debounce_key, delay, current_time):
+    """
+    Intenta tomar el debounce de una clave con una sola operación de cache
+    (cache.add = SET NX EX en Redis), sin la carrera del get + set.
+
+    Returns:
+        float: 0 si la acción está permitida, o los segundos que faltan.
+    """
+    # La clave vive al menos `delay` segundos (Redis solo acepta segundos enteros)
+    timeout = max(1, math.ceil(delay))
+    if debounce_cache.add(debounce_key, current_time, timeout=timeout):
+        return 0
+
+    # Camino de rechazo: leemos el timestamp para calcular el tiempo restante
+    last_request_time = debounce_cache.get(debounce_key)
+    if last_request_time is None:
+        # Expiró entre el add y el get: otro add atómico decide
+        return 0 if debounce_cache.add(debounce_key, current_time, timeout=timeout) else delay
+
+    remaining_time = delay - (current_time - last_request_time)
+    if remaining_time > 0:
+        return remaining_time
+
+    # La clave sigue viva solo por el redondeo del timeout. Solo una request puede
+    # renovarla: la que gana el add de una clave propia de ese timestamp
+    if debounce_cache.add(f"{debounce_key}:{last_request_time}", current_time, timeout=timeout):
+        debounce_cache.set(debounce_key, current_time, timeout=timeout)
+        return 0
+    return delay
 
 def debounce_request(delay=None, include_data=False, critical=False, error_message=None):
     """
     Decorador para prevenir requests duplicados en el backend.
     
     Args:
-        delay: Tiempo en segundos para el debounce (por defecto usa DEBOUNCE_CONFIG)
+        delay: Tiempo en segundos para el debounce (por defecto usa DEBOUNCE_DEFAULT_DELAY)
         include_data: Si incluir los datos del request en la clave del debounce
         critical: Si es una operación crítica (usa CRITICAL_DELAY)
         error_message: Mensaje personalizado de error
@@ -88,9 +142,9 @@ def debounce_request(delay=None, include_data=False, critical=False, error_messa
             if delay is not None:
                 debounce_delay = delay
             elif critical:
-                debounce_delay = DEBOUNCE_CONFIG['CRITICAL_DELAY']
+                debounce_delay = DEBOUNCE_CRITICAL_DELAY
             else:
-                debounce_delay = DEBOUNCE_CONFIG['DEFAULT_DELAY']
+                debounce_delay = DEBOUNCE_DEFAULT_DELAY
             
             # Obtener el usuario (si está autenticado)
             user_id = request.user.id if request.user.is_authenticated else request.session.session_key
@@ -102,45 +156,35 @@ def debounce_request(delay=None, include_data=False, critical=False, error_messa
             request_data = None
             if include_data:
                 if request.method == 'POST':
-                    try:
-                        request_data = json.loads(request.body.decode('utf-8'))
-                    except:
-                        request_data = dict(request.POST)
+                    request_data = request.body
                 elif request.method == 'GET':
-                    request_data = dict(request.GET)
+                    request_data = request.META.get('QUERY_STRING', '').encode()
             
             # Generar clave de debounce
             debounce_key = generate_debounce_key(user_id, view_func.__name__, request_data)
             
-            # Verificar si hay una request reciente
-            last_request_time = cache.get(debounce_key)
-            current_time = time.time()
-            
-            if last_request_time:
-                time_since_last = current_time - last_request_time
-                if time_since_last < debounce_delay:
-                    # Request muy rápida, bloquear
-                    remaining_time = debounce_delay - time_since_last
-                    
-                    default_message = f"⚠️ Operación muy rápida. Espera {remaining_time:.1f} segundos antes de intentar nuevamente."
-                    response_message = error_message or default_message
-                    
-                    return JsonResponse({
-                        'error': response_message,
-                        'debounce_remaining': round(remaining_time, 1),
-                        'retry_after': round(remaining_time, 1)
-                    }, status=429)  # Too Many Requests
+            # Verificar y registrar la request en una sola operación de cache
+            remaining_time = acquire_debounce(debounce_key, debounce_delay, time.time())
             
-            # Guardar timestamp actual en cache
-            cache.set(debounce_key, current_time, timeout=DEBOUNCE_CONFIG['MAX_CACHE_TIME'])
+            if remaining_time:
+                # Request muy rápida, bloquear
+                default_message = f"⚠️ Operación muy rápida. Espera {remaining_time:.1f} segundos antes de intentar nuevamente."
+                response_message = error_message or default_message
+                
+                return JsonResponse({
+                    'error': response_message,
+                    'debounce_remaining': round(remaining_time, 1),
+                    'retry_after': round(remaining_time, 1)
+                }, status=429)  # Too Many Requests
             
             # Ejecutar la vista original
             try:
                 return view_func(request, *args, **kwargs)
-            except Exception as e:
-                # Si hay error, limpiar el cache para permitir reintento inmediato
-                cache.delete(debounce_key)
-                raise e
+            except (DatabaseError, ConnectionError):
+                # Si falla la infraestructura, limpiar el cache para permitir reintento inmediato.
+                # Errores de la propia request (404, validación) mantienen el debounce.
+                debounce_cache.delete(debounce_key)
+                raise
         
         return wrapper
     return decorator
@@ -153,19 +197,13 @@ def debounce_user_action(action_name, user_id, delay=None, data=None):
         tuple: (is_allowed: bool, remaining_time: float)
     """
     if delay is None:
-        delay = DEBOUNCE_CONFIG['DEFAULT_DELAY']
+        delay = DEBOUNCE_DEFAULT_DELAY
     
     debounce_key = generate_debounce_key(user_id, action_name, data)
-    last_action_time = cache.get(debounce_key)
-    current_time = time.time()
-    
-    if last_action_time:
-        time_since_last = current_time - last_action_time
-        if time_since_last < delay:
-            return False, delay - time_since_last
+    remaining_time = acquire_debounce(debounce_key, delay, time.time())
     
-    # Permitir la acción y guardar timestamp
-    cache.set(debounce_key, current_time, timeout=DEBOUNCE_CONFIG['MAX_CACHE_TIME'])
+    if remaining_time:
+        return False, remaining_time
     return True, 0
 
 def clear_user_debounces(user_id):
@@ -178,7 +216,7 @@ def clear_user_debounces(user_id):
 def critical_operation(delay=None, error_message=None):
     """Decorador para operaciones críticas como crear órdenes, procesar pagos, etc."""
     return debounce_request(
-        delay=delay or DEBOUNCE_CONFIG['CRITICAL_DELAY'],
+        delay=delay or DEBOUNCE_CRITICAL_DELAY,
         include_data=True,
         critical=True,
         error_message=error_message or "⚠️ Operación en proceso. No envíes múltiples requests."
@@ -188,7 +226,7 @@ def critical_operation(delay=None, error_message=None):
 def form_debounce(delay=None):
     """Decorador específico para envío de formularios."""
     return debounce_request(
-        delay=delay or DEBOUNCE_CONFIG['FORM_DELAY'],
+        delay=delay or DEBOUNCE_FORM_DELAY,
         include_data=True,
         error_message="📝 Formulario enviado recientemente. Espera un momento antes de enviar nuevamente."
     )
@@ -213,16 +251,12 @@ class DebounceMiddleware:
             
             # Verificar debounce
             debounce_key = generate_debounce_key(user_id, f"global_{view_name}")
-            last_request_time = cache.get(debounce_key)
-            current_time = time.time()
             
-            if last_request_time and (current_time - last_request_time) < 0.5:  # 500ms global
+            if acquire_debounce(debounce_key, 0.5, time.time()):  # 500ms global
                 return JsonResponse({
                     'error': '⚠️ Requests muy rápidas. Reduce la velocidad.',
                     'global_debounce': True
                 }, status=429)
-            
-            cache.set(debounce_key, current_time, timeout=60)  # 1 minuto
         
         return self.get_response(request)
 
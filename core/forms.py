@@ -2,6 +2,15 @@
 
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
+from django.core.cache import cache
+from django.forms.models import ModelChoiceIterator, ModelChoiceIteratorValue
+from .utils import cache_compartida
+
+# Tiempo (segundos) que se cachean las opciones de los desplegables. La invalidación
+# por señales solo llega a todos los workers con cache compartida (Redis); con la
+# cache local de cada proceso se usa un tiempo corto para acotar datos viejos.
+CHOICES_CACHE_TIME = 300
+CHOICES_CACHE_TIME_LOCAL = 15
 
 class CustomAuthenticationForm(AuthenticationForm):
     def __init__(self, *args, **kwargs):
@@ -15,4 +24,41 @@ class CustomAuthenticationForm(AuthenticationForm):
         self.fields['password'].widget.attrs.update({
             'class': 'form-control',
             'placeholder': 'Contraseña'
-        })
\ No newline at end of file
+        })
+
+
+# --- Desplegables cacheados para tablas de referencia pequeñas ---
+
+def choices_cache_key(model):
+    """Clave de cache con las opciones (pk, etiqueta) de un modelo."""
+    return f"choices_{model._meta.label_lower}"
+
+def get_cached_choices(queryset):
+    """
+    Devuelve la lista [(pk, etiqueta), ...] de un modelo completo desde cache.
+    Se invalida con las señales post_save/post_delete del modelo (ver signals.py).
+    """
+    cache_key = choices_cache_key(queryset.model)
+    choices = cache.get(cache_key)
+    if choices is None:
+        choices = [(obj.pk, str(obj)) for obj in queryset]
+        timeout = CHOICES_CACHE_TIME if cache_compartida() else CHOICES_CACHE_TIME_LOCAL
+        cache.set(cache_key, choices, timeout=timeout)
+    return choices
+
+class CachedModelChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for pk, label in get_cached_choices(self.queryset):
+            yield (ModelChoiceIteratorValue(pk, None), label)
+
+    def __len__(self):
+        return len(get_cached_choices(self.queryset)) + (1 if self.field.empty_label is not None else 0)
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField que pinta sus opciones desde cache en vez de consultar la
+    tabla en cada formulario. Solo para querysets sin filtrar de tablas pequeñas.
+    """
+    iterator = CachedModelChoiceIterator
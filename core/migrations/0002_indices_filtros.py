@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-16 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='factura',
+            index=models.Index(fields=['estado_pago', '-creado_en'], name='factura_estado_creado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['estado', '-creado_en'], name='orden_estado_creado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['mesa', 'estado'], name='orden_mesa_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['is_active', 'is_available', 'id_categoria'], name='producto_activo_disp_idx'),
+        ),
+    ]
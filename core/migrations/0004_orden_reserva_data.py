@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-16 02:33
+
+import json
+
+from django.db import migrations, models
+
+
+def migrar_reservas_observaciones(apps, schema_editor):
+    """Copia el JSON 'RESERVA:{...}' de observaciones a los nuevos campos."""
+    Orden = apps.get_model('core', 'Orden')
+    reservas = Orden.objects.filter(observaciones__startswith='RESERVA:').only('id', 'observaciones')
+    actualizadas = []
+    for orden in reservas.iterator(chunk_size=2000):
+        try:
+            orden.reserva_data = json.loads(orden.observaciones[8:])
+        except ValueError:
+            continue
+        orden.es_reserva = True
+        actualizadas.append(orden)
+    Orden.objects.bulk_update(actualizadas, ['es_reserva', 'reserva_data'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_indice_nombre_producto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orden',
+            name='es_reserva',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='orden',
+            name='reserva_data',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(migrar_reservas_observaciones, migrations.RunPython.noop),
+    ]
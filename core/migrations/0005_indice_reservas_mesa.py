@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-16 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_orden_reserva_data'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['mesa', 'es_reserva', 'creado_en'], name='orden_reserva_mesa_idx'),
+        ),
+    ]
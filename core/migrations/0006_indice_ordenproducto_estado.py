@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-16 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_indice_reservas_mesa'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ordenproducto',
+            index=models.Index(fields=['orden', 'estado'], name='ordenproducto_orden_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-16 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_indice_ordenproducto_estado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['mesero', 'estado'], name='orden_mesero_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-16 02:51
+
+from django.db import migrations, models
+
+
+def migrar_tipo_agregado(apps, schema_editor):
+    """Traslada los marcadores AGREGADO_* de observaciones a tipo_agregado."""
+    OrdenProducto = apps.get_model('core', 'OrdenProducto')
+    OrdenProducto.objects.filter(
+        observaciones__startswith='AGREGADO_POST_FACTURA'
+    ).update(tipo_agregado='POST_FACTURA')
+    OrdenProducto.objects.filter(
+        observaciones__startswith='AGREGADO_DESPUES'
+    ).update(tipo_agregado='DESPUES')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_indice_orden_mesero_estado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordenproducto',
+            name='tipo_agregado',
+            field=models.CharField(choices=[('ORIGINAL', 'Original'), ('DESPUES', 'Agregado después'), ('POST_FACTURA', 'Agregado post-factura')], db_index=True, default='ORIGINAL', max_length=20),
+        ),
+        migrations.RunPython(migrar_tipo_agregado, migrations.RunPython.noop),
+    ]
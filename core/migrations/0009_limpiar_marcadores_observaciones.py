@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-16 08:14
+
+from django.db import migrations
+from django.db.models.functions import Substr
+
+MARCADORES = ('AGREGADO_POST_FACTURA', 'AGREGADO_DESPUES')
+
+
+def limpiar_marcadores(apps, schema_editor):
+    """Quita de observaciones los marcadores AGREGADO_* ya trasladados a tipo_agregado."""
+    OrdenProducto = apps.get_model('core', 'OrdenProducto')
+    for marcador in MARCADORES:
+        OrdenProducto.objects.filter(observaciones=marcador).update(observaciones='')
+        OrdenProducto.objects.filter(observaciones__startswith=f'{marcador}|').update(
+            observaciones=Substr('observaciones', len(marcador) + 2)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_ordenproducto_tipo_agregado'),
+    ]
+
+    operations = [
+        migrations.RunPython(limpiar_marcadores, migrations.RunPython.noop),
+    ]
@@ -49,6 +49,11 @@ class Producto(models.Model):
     imagen_url = models.URLField(max_length=255, blank=True, null=True) # <-- CORREGIDO
     is_available = models.BooleanField(default=True)
     is_active = models.BooleanField(default=True) # <-- CORREGIDO
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'is_available', 'id_categoria'], name='producto_activo_disp_idx'),
+            models.Index(fields=['nombre'], name='producto_nombre_idx'),
+        ]
     def __str__(self): return self.nombre
 
 class Mesa(models.Model):
@@ -69,6 +74,15 @@ class Orden(models.Model):
     confirmado_en = models.DateTimeField(null=True, blank=True) # <-- CORREGIDO
     enviado_cocina_en = models.DateTimeField(null=True, blank=True) # <-- CORREGIDO
     listo_en = models.DateTimeField(null=True, blank=True) # <-- CORREGIDO
+    es_reserva = models.BooleanField(default=False, db_index=True)
+    reserva_data = models.JSONField(blank=True, null=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', '-creado_en'], name='orden_estado_creado_idx'),
+            models.Index(fields=['mesa', 'estado'], name='orden_mesa_estado_idx'),
+            models.Index(fields=['mesa', 'es_reserva', 'creado_en'], name='orden_reserva_mesa_idx'),
+            models.Index(fields=['mesero', 'estado'], name='orden_mesero_estado_idx'),
+        ]
 
 class OrdenProducto(models.Model):
     orden = models.ForeignKey(Orden, on_delete=models.CASCADE, related_name='productos_ordenados')
@@ -78,6 +92,16 @@ class OrdenProducto(models.Model):
     estado = models.CharField(max_length=20, default='PENDIENTE') # <-- CORREGIDO
     observaciones = models.CharField(max_length=300, blank=True, null=True)
     listo_en = models.DateTimeField(null=True, blank=True) # <-- CORREGIDO
+    TIPOS_AGREGADO = [
+        ('ORIGINAL', 'Original'),
+        ('DESPUES', 'Agregado después'),
+        ('POST_FACTURA', 'Agregado post-factura'),
+    ]
+    tipo_agregado = models.CharField(max_length=20, choices=TIPOS_AGREGADO, default='ORIGINAL', db_index=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['orden', 'estado'], name='ordenproducto_orden_estado_idx'),
+        ]
 
 class Factura(models.Model):
     numero_factura = models.CharField(max_length=20, unique=True, blank=True, null=True) # <-- CORREGIDO
@@ -94,4 +118,8 @@ class Factura(models.Model):
     observaciones = models.TextField(blank=True, null=True) # <-- CORREGIDO
     creado_en = models.DateTimeField(auto_now_add=True)
     pagado_en = models.DateTimeField(null=True, blank=True) # <-- CORREGIDO
-    def __str__(self): return f"Factura para Orden #{self.orden.id}"
\ No newline at end of file
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado_pago', '-creado_en'], name='factura_estado_creado_idx'),
+        ]
+    def __str__(self): return f"Factura para Orden #{self.orden_id}"
\ No newline at end of file
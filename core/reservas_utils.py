@@ -1,48 +1,57 @@
 # core/reservas_utils.py - CREAR ESTE NUEVO ARCHIVO
 """
-Sistema de reservas usando las tablas existentes sin modificar modelos.
-Usa las observaciones de Orden para manejar reservas.
+Sistema de reservas usando las tablas existentes.
+Una reserva es una Orden con es_reserva=True y sus datos en Orden.reserva_data.
 """
 
 from django.utils import timezone
 from django.db import transaction
 from datetime import datetime, timedelta
 from .models import Mesa, Orden, Usuario
-import json
 
 # === CONSTANTES PARA RESERVAS ===
 MESA_DOMICILIO = 0
 MESA_LLEVAR = 50
+ESTADOS_RESERVA_ACTIVA = ['PENDIENTE', 'CONFIRMADA', 'EN_CURSO']
+
+# Estado de reserva -> (campo de timestamp, nuevo estado de la mesa)
+TRANSICIONES_RESERVA = {
+    'CONFIRMADA': ('confirmado_en', None),
+    'EN_CURSO': ('iniciado_en', 'OCUPADA'),
+    'COMPLETADA': ('completado_en', 'LIBRE'),
+}
 
 class ReservasManager:
     """Gestor de reservas usando la infraestructura existente"""
     
+    # ids de las mesas especiales (0 y 50), no cambian en la vida del proceso
+    _MESAS_ESPECIALES = {}
+    
+    @classmethod
+    def mesa_especial_id(cls, numero):
+        """Id de una mesa especial, consultado una sola vez por proceso"""
+        if numero not in cls._MESAS_ESPECIALES:
+            cls._MESAS_ESPECIALES[numero] = Mesa.objects.values_list('id', flat=True).get(numero=numero)
+        return cls._MESAS_ESPECIALES[numero]
+    
     @staticmethod
     def crear_mesas_especiales():
         """Crear mesas especiales 0 y 50 si no existen"""
         try:
-            # Mesa 0 para domicilios
-            mesa_domicilio, created = Mesa.objects.get_or_create(
-                numero=MESA_DOMICILIO,
-                defaults={
-                    'ubicacion': 'Domicilio',
-                    'capacidad': 99,
-                    'estado': 'LIBRE',  # Siempre libre para nuevas órdenes
-                    'is_active': True
-                }
-            )
+            # Mesa 0 para domicilios y mesa 50 para llevar (siempre libres para nuevas órdenes)
+            Mesa.objects.bulk_create([
+                Mesa(numero=MESA_DOMICILIO, ubicacion='Domicilio', capacidad=99, estado='LIBRE', is_active=True),
+                Mesa(numero=MESA_LLEVAR, ubicacion='Para Llevar', capacidad=99, estado='LIBRE', is_active=True),
+            ], ignore_conflicts=True)
             
-            # Mesa 50 para llevar
-            mesa_llevar, created = Mesa.objects.get_or_create(
-                numero=MESA_LLEVAR,
-                defaults={
-                    'ubicacion': 'Para Llevar',
-                    'capacidad': 99,
-                    'estado': 'LIBRE',  # Siempre libre para nuevas órdenes
-                    'is_active': True
-                }
-            )
+            mesas = Mesa.objects.in_bulk([MESA_DOMICILIO, MESA_LLEVAR], field_name='numero')
+            mesa_domicilio = mesas[MESA_DOMICILIO]
+            mesa_llevar = mesas[MESA_LLEVAR]
             
+            ReservasManager._MESAS_ESPECIALES = {
+                MESA_DOMICILIO: mesa_domicilio.id,
+                MESA_LLEVAR: mesa_llevar.id,
+            }
             return mesa_domicilio, mesa_llevar
             
         except Exception as e:
@@ -71,18 +80,18 @@ class ReservasManager:
             with transaction.atomic():
                 # Determinar mesa según tipo
                 if datos_reserva['tipo'] == 'DOMICILIO':
-                    mesa = Mesa.objects.get(numero=MESA_DOMICILIO)
+                    mesa_id = ReservasManager.mesa_especial_id(MESA_DOMICILIO)
                 elif datos_reserva['tipo'] == 'LLEVATE':
-                    mesa = Mesa.objects.get(numero=MESA_LLEVAR)
+                    mesa_id = ReservasManager.mesa_especial_id(MESA_LLEVAR)
                 else:  # MESA
                     mesa = Mesa.objects.get(id=datos_reserva['mesa_id'])
-                
-                # Validar disponibilidad para mesas normales
-                if datos_reserva['tipo'] == 'MESA':
+                    mesa_id = mesa.id
+                    
+                    # Validar disponibilidad para mesas normales
                     if ReservasManager.mesa_reservada_en_fecha(mesa, datos_reserva['fecha_reserva']):
                         raise ValueError(f"La mesa {mesa.numero} ya está reservada para esa fecha/hora")
                 
-                # Crear datos de reserva en JSON para observaciones
+                # Datos de la reserva (se guardan en reserva_data)
                 reserva_info = {
                     'es_reserva': True,
                     'tipo_reserva': datos_reserva['tipo'],
@@ -104,17 +113,17 @@ class ReservasManager:
                 
                 # Crear orden como reserva
                 nueva_reserva = Orden.objects.create(
-                    mesa=mesa,
+                    mesa_id=mesa_id,
                     mesero=creado_por,
                     estado='NUEVA',  # Estado especial para reservas
-                    observaciones=f"RESERVA:{json.dumps(reserva_info)}"
+                    es_reserva=True,
+                    reserva_data=reserva_info,
+                    observaciones=observaciones_generales
                 )
                 
-                # Generar número de reserva
-                numero_reserva = f"R-{nueva_reserva.id:06d}"
+                # El número de reserva se deriva del id, no se guarda (un solo INSERT)
+                numero_reserva = ReservasManager.numero_reserva(nueva_reserva.id)
                 reserva_info['numero_reserva'] = numero_reserva
-                nueva_reserva.observaciones = f"RESERVA:{json.dumps(reserva_info)}"
-                nueva_reserva.save()
                 
                 return nueva_reserva, numero_reserva
                 
@@ -124,55 +133,82 @@ class ReservasManager:
     @staticmethod
     def obtener_reservas(filtros=None):
         """Obtener todas las reservas del sistema"""
-        # Buscar órdenes que tengan 'RESERVA:' en observaciones
-        ordenes_reserva = Orden.objects.filter(
-            observaciones__startswith='RESERVA:'
+        return list(ReservasManager.iter_reservas(filtros))
+    
+    @staticmethod
+    def iter_reservas(filtros=None):
+        """
+        Igual que obtener_reservas pero como generador: las filas se leen
+        por bloques sin cargar todas las reservas en memoria.
+        """
+        ordenes_reserva = Orden.objects.filter(es_reserva=True).select_related('mesa', 'mesero').only(
+            'id', 'creado_en', 'es_reserva', 'reserva_data',
+            'mesa__id', 'mesa__numero', 'mesa__ubicacion',
+            'mesero__id', 'mesero__nombre'
         ).order_by('-creado_en')
         
-        reservas = []
-        for orden in ordenes_reserva:
-            try:
-                reserva_data = ReservasManager.extraer_datos_reserva(orden)
-                if reserva_data:
-                    # Aplicar filtros si existen
-                    if filtros:
-                        if filtros.get('estado') and reserva_data.get('estado_reserva') != filtros['estado']:
-                            continue
-                        if filtros.get('tipo') and reserva_data.get('tipo_reserva') != filtros['tipo']:
-                            continue
-                        if filtros.get('mesero_id') and orden.mesero.id != filtros['mesero_id']:
-                            continue
-                    
-                    reservas.append({
-                        'orden_id': orden.id,
-                        'reserva_data': reserva_data,
-                        'mesa': {
-                            'id': orden.mesa.id,
-                            'numero': orden.mesa.numero,
-                            'ubicacion': orden.mesa.ubicacion
-                        },
-                        'mesero': {
-                            'id': orden.mesero.id,
-                            'nombre': orden.mesero.nombre
-                        },
-                        'creado_en': orden.creado_en.isoformat()
-                    })
-            except:
-                continue
+        # Los filtros se resuelven en la BD sobre los campos de reserva_data
+        if filtros:
+            if filtros.get('estado'):
+                ordenes_reserva = ordenes_reserva.filter(reserva_data__estado_reserva=filtros['estado'])
+            if filtros.get('tipo'):
+                ordenes_reserva = ordenes_reserva.filter(reserva_data__tipo_reserva=filtros['tipo'])
+            if filtros.get('mesero_id'):
+                ordenes_reserva = ordenes_reserva.filter(mesero_id=filtros['mesero_id'])
         
-        return reservas
+        for orden in ordenes_reserva.iterator(chunk_size=2000):
+            reserva_data = ReservasManager.extraer_datos_reserva(orden)
+            if reserva_data:
+                yield {
+                    'orden_id': orden.id,
+                    'reserva_data': reserva_data,
+                    'mesa': {
+                        'id': orden.mesa.id,
+                        'numero': orden.mesa.numero,
+                        'ubicacion': orden.mesa.ubicacion
+                    },
+                    'mesero': {
+                        'id': orden.mesero.id,
+                        'nombre': orden.mesero.nombre
+                    },
+                    'creado_en': orden.creado_en.isoformat()
+                }
+    
+    @staticmethod
+    def numero_reserva(orden_id):
+        """Número legible de una reserva a partir del id de su orden"""
+        return f"R-{orden_id:06d}"
     
     @staticmethod
     def extraer_datos_reserva(orden):
-        """Extraer datos de reserva de las observaciones de una orden"""
-        try:
-            if not orden.observaciones or not orden.observaciones.startswith('RESERVA:'):
-                return None
-            
-            json_data = orden.observaciones[8:]  # Remover 'RESERVA:'
-            return json.loads(json_data)
-        except:
+        """Extraer datos de reserva de una orden"""
+        if not orden.es_reserva or orden.reserva_data is None:
             return None
+        orden.reserva_data.setdefault('numero_reserva', ReservasManager.numero_reserva(orden.id))
+        return orden.reserva_data
+    
+    @staticmethod
+    def _aplicar_estado(reserva_data, nuevo_estado, ahora):
+        """
+        Aplica un cambio de estado sobre los datos de la reserva (en memoria).
+        Devuelve el estado que debe tomar la mesa, o None si no cambia.
+        """
+        reserva_data['estado_reserva'] = nuevo_estado
+        
+        transicion = TRANSICIONES_RESERVA.get(nuevo_estado)
+        if transicion is None:
+            return None
+        
+        campo_timestamp, estado_mesa = transicion
+        reserva_data[campo_timestamp] = ahora.isoformat()
+        return estado_mesa
+    
+    @staticmethod
+    def _actualizar_estado_mesas(mesa_ids, estado_mesa):
+        """Un solo UPDATE condicional; las mesas especiales nunca cambian de estado"""
+        return Mesa.objects.filter(pk__in=mesa_ids).exclude(
+            numero__in=[MESA_DOMICILIO, MESA_LLEVAR]
+        ).update(estado=estado_mesa)
     
     @staticmethod
     def actualizar_estado_reserva(orden_id, nuevo_estado):
@@ -184,26 +220,12 @@ class ReservasManager:
             if not reserva_data:
                 raise ValueError("No es una reserva válida")
             
-            reserva_data['estado_reserva'] = nuevo_estado
+            estado_mesa = ReservasManager._aplicar_estado(reserva_data, nuevo_estado, timezone.now())
+            if estado_mesa:
+                ReservasManager._actualizar_estado_mesas([orden.mesa_id], estado_mesa)
             
-            # Actualizar timestamps según estado
-            if nuevo_estado == 'CONFIRMADA':
-                reserva_data['confirmado_en'] = timezone.now().isoformat()
-            elif nuevo_estado == 'EN_CURSO':
-                reserva_data['iniciado_en'] = timezone.now().isoformat()
-                # Para mesas normales, marcar como ocupada
-                if orden.mesa.numero not in [MESA_DOMICILIO, MESA_LLEVAR]:
-                    orden.mesa.estado = 'OCUPADA'
-                    orden.mesa.save()
-            elif nuevo_estado == 'COMPLETADA':
-                reserva_data['completado_en'] = timezone.now().isoformat()
-                # Liberar mesa si no es especial
-                if orden.mesa.numero not in [MESA_DOMICILIO, MESA_LLEVAR]:
-                    orden.mesa.estado = 'LIBRE'
-                    orden.mesa.save()
-            
-            orden.observaciones = f"RESERVA:{json.dumps(reserva_data)}"
-            orden.save()
+            orden.reserva_data = reserva_data
+            orden.save(update_fields=['reserva_data'])
             
             return True
             
@@ -211,6 +233,35 @@ class ReservasManager:
             print(f"Error actualizando reserva: {e}")
             return False
     
+    @staticmethod
+    def bulk_actualizar_estado_reservas(orden_ids, nuevo_estado):
+        """
+        Actualizar el estado de varias reservas a la vez (p. ej. al cerrar turno).
+        Devuelve el número de reservas actualizadas.
+        """
+        ahora = timezone.now()
+        ordenes = list(Orden.objects.filter(id__in=orden_ids, es_reserva=True).only(
+            'id', 'mesa_id', 'es_reserva', 'reserva_data'
+        ))
+        
+        actualizadas = []
+        mesas_por_estado = {}
+        for orden in ordenes:
+            reserva_data = ReservasManager.extraer_datos_reserva(orden)
+            if not reserva_data:
+                continue
+            estado_mesa = ReservasManager._aplicar_estado(reserva_data, nuevo_estado, ahora)
+            if estado_mesa:
+                mesas_por_estado.setdefault(estado_mesa, set()).add(orden.mesa_id)
+            actualizadas.append(orden)
+        
+        with transaction.atomic():
+            Orden.objects.bulk_update(actualizadas, ['reserva_data'], batch_size=500)
+            for estado_mesa, mesa_ids in mesas_por_estado.items():
+                ReservasManager._actualizar_estado_mesas(mesa_ids, estado_mesa)
+        
+        return len(actualizadas)
+    
     @staticmethod
     def mesa_reservada_en_fecha(mesa, fecha_reserva):
         """Verificar si una mesa está reservada en una fecha específica"""
@@ -218,18 +269,12 @@ class ReservasManager:
         fecha_inicio = fecha_reserva - timedelta(hours=2)
         fecha_fin = fecha_reserva + timedelta(hours=2)
         
-        reservas_existentes = Orden.objects.filter(
+        return Orden.objects.filter(
             mesa=mesa,
-            observaciones__startswith='RESERVA:',
-            creado_en__range=[fecha_inicio, fecha_fin]
-        )
-        
-        for orden in reservas_existentes:
-            reserva_data = ReservasManager.extraer_datos_reserva(orden)
-            if reserva_data and reserva_data.get('estado_reserva') in ['PENDIENTE', 'CONFIRMADA', 'EN_CURSO']:
-                return True
-        
-        return False
+            es_reserva=True,
+            creado_en__range=[fecha_inicio, fecha_fin],
+            reserva_data__estado_reserva__in=ESTADOS_RESERVA_ACTIVA
+        ).exists()
     
     @staticmethod
     def obtener_mesas_disponibles_para_reserva(fecha_reserva):
@@ -265,8 +310,15 @@ class ReservasManager:
             numero__in=[MESA_DOMICILIO, MESA_LLEVAR]
         )
         
+        # Una sola consulta con las mesas que tienen reserva activa en la ventana
+        mesas_reservadas = set(Orden.objects.filter(
+            es_reserva=True,
+            creado_en__range=[fecha_reserva - timedelta(hours=2), fecha_reserva + timedelta(hours=2)],
+            reserva_data__estado_reserva__in=ESTADOS_RESERVA_ACTIVA
+        ).values_list('mesa_id', flat=True))
+        
         for mesa in mesas_normales:
-            if not ReservasManager.mesa_reservada_en_fecha(mesa, fecha_reserva):
+            if mesa.id not in mesas_reservadas:
                 mesas_disponibles.append({
                     'id': mesa.id,
                     'numero': mesa.numero,
@@ -292,23 +344,18 @@ class ReservasManager:
                 if reserva_data.get('estado_reserva') != 'CONFIRMADA':
                     raise ValueError("La reserva debe estar confirmada")
                 
-                # Actualizar estado a EN_CURSO
-                reserva_data['estado_reserva'] = 'EN_CURSO'
-                reserva_data['iniciado_en'] = timezone.now().isoformat()
+                # Actualizar estado a EN_CURSO y ocupar la mesa si es necesario
+                estado_mesa = ReservasManager._aplicar_estado(reserva_data, 'EN_CURSO', timezone.now())
+                ReservasManager._actualizar_estado_mesas([orden.mesa_id], estado_mesa)
                 
                 # Cambiar estado de orden
                 orden.estado = 'EN_PROCESO'
                 if mesero:
                     orden.mesero = mesero
                 
-                # Ocupar mesa si es necesario
-                if orden.mesa.numero not in [MESA_DOMICILIO, MESA_LLEVAR]:
-                    orden.mesa.estado = 'OCUPADA'
-                    orden.mesa.save()
-                
-                # Actualizar observaciones para mantener info de reserva
-                orden.observaciones = f"RESERVA:{json.dumps(reserva_data)}"
-                orden.save()
+                # Actualizar datos de reserva
+                orden.reserva_data = reserva_data
+                orden.save(update_fields=['estado', 'mesero', 'reserva_data'])
                 
                 return orden
                 
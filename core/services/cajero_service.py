@@ -8,22 +8,33 @@ from decimal import Decimal
 from datetime import timedelta
 from django.db import transaction
 from django.utils import timezone
-from django.db.models import Sum, Count, Q, Avg
+from django.db.models import Sum, Count, Q, Avg, Case, When, F, PositiveIntegerField
 
 from ..models import Orden, OrdenProducto, Factura, Mesa, Producto
-from ..utils import calcular_total_orden
+from ..utils import calcular_total_orden_sql, notificar_cambio_stock
 
+# Constantes Decimal precalculadas (no se construyen en cada factura)
+CIEN = Decimal(100)
+IVA_PORCENTAJE = Decimal('19.0')  # 19% IVA Colombia
+IVA_FACTOR = IVA_PORCENTAJE / CIEN
+CERO = Decimal('0')
 
 class CajeroService:
     """Servicio que maneja toda la lógica de negocio específica del cajero."""
     
+    # Columnas que lee _formatear_factura_para_cajero
+    FILAS_FACTURA_CAJERO = (
+        'id', 'numero_factura', 'total', 'estado_pago', 'creado_en',
+        'orden_id', 'orden__mesa__numero', 'orden__mesero__nombre'
+    )
+    
     def __init__(self):
         self.METODOS_PAGO = [
             'EFECTIVO', 'TARJETA_CREDITO', 'TARJETA_DEBITO', 
             'TRANSFERENCIA', 'DIGITAL', 'MIXTO'
         ]
         self.ESTADOS_PAGO = ['NO_PAGADA', 'PARCIAL', 'PAGADA', 'REEMBOLSADA']
-        self.IVA_PORCENTAJE = Decimal('19.0')  # 19% IVA Colombia
+        self.IVA_PORCENTAJE = IVA_PORCENTAJE
     
     # === GESTIÓN DE FACTURAS ===
     
@@ -52,21 +63,24 @@ class CajeroService:
                 }
             
             # Verificar si ya tiene factura
-            if hasattr(orden, 'factura'):
+            if Factura.objects.filter(orden_id=orden.id).exists():
                 return {
                     'success': False,
                     'errores': ['La orden ya tiene una factura asociada']
                 }
             
             # Calcular totales
-            subtotal = calcular_total_orden(orden)
-            descuento_amount = subtotal * (Decimal(str(aplicar_descuento)) / 100)
+            subtotal = calcular_total_orden_sql(orden.id)
+            if aplicar_descuento:
+                descuento_amount = subtotal * Decimal(str(aplicar_descuento)) / CIEN
+            else:
+                descuento_amount = CERO
             base_gravable = subtotal - descuento_amount
             
             if aplicar_iva:
-                impuesto = base_gravable * (self.IVA_PORCENTAJE / 100)
+                impuesto = base_gravable * IVA_FACTOR
             else:
-                impuesto = Decimal('0')
+                impuesto = CERO
             
             total = base_gravable + impuesto
             
@@ -132,7 +146,11 @@ class CajeroService:
             dict: Resultado del pago con información del cambio
         """
         try:
-            factura = Factura.objects.get(id=factura_id)
+            # Solo las columnas que se usan; de la orden basta con el id de su mesa
+            factura = Factura.objects.select_related('orden').only(
+                'id', 'numero_factura', 'total', 'estado_pago', 'metodo_pago',
+                'observaciones', 'pagado_en', 'orden__id', 'orden__mesa'
+            ).get(id=factura_id)
             
             # Validar estado de la factura
             if factura.estado_pago == 'PAGADA':
@@ -180,14 +198,13 @@ class CajeroService:
             factura.estado_pago = nuevo_estado
             if observaciones_pago:
                 factura.observaciones = f"{factura.observaciones or ''}\nPago: {observaciones_pago}".strip()
-            factura.save()
+            factura.save(update_fields=['metodo_pago', 'estado_pago', 'pagado_en', 'observaciones'])
             
-            # Si el pago está completo, liberar la mesa
+            # Si el pago está completo, liberar la mesa (un UPDATE condicional)
             if nuevo_estado == 'PAGADA':
-                orden = factura.orden
-                if orden.mesa.numero not in [0, 50]:  # No liberar mesas especiales
-                    orden.mesa.estado = 'LIBRE'
-                    orden.mesa.save()
+                Mesa.objects.filter(pk=factura.orden.mesa_id).exclude(
+                    numero__in=[0, 50]  # No liberar mesas especiales
+                ).update(estado='LIBRE')
             
             resultado = {
                 'success': True,
@@ -261,14 +278,22 @@ class CajeroService:
             # Procesar reembolso
             factura.estado_pago = 'REEMBOLSADA'
             factura.observaciones = f"{factura.observaciones or ''}\nReembolso: {motivo_reembolso} - Monto: ${monto_reembolso}".strip()
-            factura.save()
-            
-            # Actualizar inventario (devolver productos)
-            orden = factura.orden
-            for producto_orden in orden.productos_ordenados.all():
-                producto = producto_orden.producto
-                producto.cantidad += producto_orden.cantidad
-                producto.save()
+            factura.save(update_fields=['estado_pago', 'observaciones'])
+            
+            # Actualizar inventario (devolver productos) con un solo UPDATE
+            cantidades = {}
+            for producto_id, cantidad in OrdenProducto.objects.filter(
+                orden_id=factura.orden_id
+            ).values_list('producto_id', 'cantidad'):
+                cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+            
+            if cantidades:
+                Producto.objects.filter(id__in=cantidades).update(cantidad=Case(
+                    *[When(id=producto_id, then=F('cantidad') + cantidad) for producto_id, cantidad in cantidades.items()],
+                    default=F('cantidad'),
+                    output_field=PositiveIntegerField()
+                ))
+                notificar_cambio_stock()
             
             return {
                 'success': True,
@@ -297,14 +322,12 @@ class CajeroService:
     def obtener_facturas_pendientes(self, limite=50):
         """Obtiene facturas pendientes de pago."""
         try:
+            # values() evita instanciar Factura/Orden/Mesa/Usuario por cada fila
             facturas = Factura.objects.filter(
                 estado_pago__in=['NO_PAGADA', 'PARCIAL']
-            ).select_related('orden', 'orden__mesa', 'orden__mesero').order_by('-creado_en')[:limite]
+            ).order_by('-creado_en').values(*self.FILAS_FACTURA_CAJERO)[:limite]
             
-            facturas_data = []
-            for factura in facturas:
-                factura_info = self._formatear_factura_para_cajero(factura)
-                facturas_data.append(factura_info)
+            facturas_data = [self._formatear_factura_para_cajero(factura) for factura in facturas]
             
             return {
                 'success': True,
@@ -318,6 +341,22 @@ class CajeroService:
                 'errores': [f'Error obteniendo facturas pendientes: {str(e)}']
             }
     
+    def _formatear_factura_para_cajero(self, fila):
+        """
+        Formatea una fila de FILAS_FACTURA_CAJERO para el cajero.
+        Claves: id, numero_factura, total, estado_pago, creado_en, orden_id, mesa, mesero.
+        """
+        return {
+            'id': fila['id'],
+            'numero_factura': fila['numero_factura'] or f"FAC-{fila['id']:06d}",
+            'total': float(fila['total']),
+            'estado_pago': fila['estado_pago'],
+            'creado_en': fila['creado_en'].isoformat(),
+            'orden_id': fila['orden_id'],
+            'mesa': fila['orden__mesa__numero'],
+            'mesero': fila['orden__mesero__nombre'],
+        }
+    
     def obtener_factura_detallada(self, factura_id):
         """Obtiene los detalles completos de una factura."""
         try:
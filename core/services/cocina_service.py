@@ -4,26 +4,40 @@ Servicio de negocio para operaciones específicas de la cocina.
 Contiene toda la lógica relacionada con la preparación de alimentos y gestión del estado de productos.
 """
 
-from django.db import transaction
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, F, Case, When, Value, CharField, Count, Max
 
 from ..models import Orden, OrdenProducto, Producto
 from ..utils import (
-    obtener_datos_completos_orden, notificar_cambio_cocina, 
-    notificar_cambio_stock, calcular_total_orden
+    obtener_datos_completos_orden, obtener_orden_con_productos, notificar_cambio_cocina, 
+    notificar_cambio_stock, calcular_total_orden, generar_hash_estado_cocina,
+    cache_compartida
 )
 
 
 class CocinaService:
     """Servicio que maneja toda la lógica de negocio específica de la cocina."""
     
-    def __init__(self):
-        self.ESTADOS_ORDEN_ACTIVA = ['EN_PROCESO', 'NUEVA', 'LISTA']
-        self.ESTADOS_PRODUCTO_PENDIENTE = ['PENDIENTE']
+    ESTADOS_ORDEN_ACTIVA = frozenset(('EN_PROCESO', 'NUEVA', 'LISTA'))
+    ESTADOS_PRODUCTO_PENDIENTE = frozenset(('PENDIENTE',))
     
     # === GESTIÓN DE PRODUCTOS EN ÓRDENES ===
     
+    def _productos_orden_bloqueados(self):
+        """
+        OrdenProducto con select_for_update. Bloquea solo su fila (no orden ni producto)
+        cuando la BD admite FOR UPDATE OF; MariaDB y MySQL < 8.0.1 no lo admiten.
+        """
+        if connection.features.has_select_for_update_of:
+            return OrdenProducto.objects.select_for_update(of=('self',))
+        return OrdenProducto.objects.select_for_update()
+    
     @transaction.atomic
     def marcar_producto_listo(self, producto_orden_id, usuario_cocina):
         """
@@ -37,69 +51,67 @@ class CocinaService:
             dict: Resultado de la operación con información detallada
         """
         try:
-            producto_orden = OrdenProducto.objects.select_related('orden', 'producto').get(
-                id=producto_orden_id
-            )
-            
-            # Validaciones de estado
-            if producto_orden.estado == 'LISTO':
-                return {
-                    'success': False,
-                    'errores': ['El producto ya está marcado como listo']
-                }
-            
-            orden = producto_orden.orden
-            if orden.estado not in self.ESTADOS_ORDEN_ACTIVA:
-                return {
-                    'success': False,
-                    'errores': [f'No se puede modificar orden con estado: {orden.estado}']
-                }
-            
-            # Marcar producto como listo
-            producto_nombre = producto_orden.producto.nombre
-            producto_orden.estado = 'LISTO'
-            producto_orden.listo_en = timezone.now()
-            producto_orden.save()
-            
-            # Verificar si la orden está completa
-            productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
-            orden_completa = productos_pendientes == 0
-            
-            if orden_completa:
-                orden.estado = 'LISTA'
-                orden.listo_en = timezone.now()
-                orden.save()
-            
-            # Notificar cambios
-            notificar_cambio_cocina()
-            
-            # Preparar respuesta
-            mensaje = (
-                f'¡Orden #{orden.id} completa y lista para servir!' if orden_completa
-                else f'Producto {producto_nombre} completado. Faltan {productos_pendientes} productos.'
-            )
-            
-            return {
-                'success': True,
-                'producto_listo': True,
-                'producto_nombre': producto_nombre,
-                'orden_completa': orden_completa,
-                'productos_restantes': productos_pendientes,
-                'orden_id': orden.id,
-                'mensaje': mensaje,
-                'orden_data': obtener_datos_completos_orden(orden)
-            }
-            
+            producto_orden = self._productos_orden_bloqueados().select_related(
+                'orden', 'producto'
+            ).get(id=producto_orden_id)
         except OrdenProducto.DoesNotExist:
             return {
                 'success': False,
                 'errores': ['Producto de orden no encontrado']
             }
-        except Exception as e:
+        
+        # Validaciones de estado
+        if producto_orden.estado == 'LISTO':
             return {
                 'success': False,
-                'errores': [f'Error interno: {str(e)}']
+                'errores': ['El producto ya está marcado como listo']
             }
+        
+        orden = producto_orden.orden
+        if orden.estado not in self.ESTADOS_ORDEN_ACTIVA:
+            return {
+                'success': False,
+                'errores': [f'No se puede modificar orden con estado: {orden.estado}']
+            }
+        
+        # Marcar producto como listo
+        producto_nombre = producto_orden.producto.nombre
+        ahora = timezone.now()
+        producto_orden.estado = 'LISTO'
+        producto_orden.listo_en = ahora
+        producto_orden.save(update_fields=['estado', 'listo_en'])
+        
+        # Verificar si la orden está completa; solo se cuenta si quedan pendientes
+        pendientes_qs = OrdenProducto.objects.filter(
+            orden_id=producto_orden.orden_id, estado='PENDIENTE'
+        )
+        orden_completa = not pendientes_qs.exists()
+        productos_pendientes = 0 if orden_completa else pendientes_qs.count()
+        
+        if orden_completa:
+            orden.estado = 'LISTA'
+            orden.listo_en = ahora
+            orden.save(update_fields=['estado', 'listo_en'])
+        
+        # Notificar cambios
+        notificar_cambio_cocina()
+        
+        # Preparar respuesta
+        mensaje = (
+            f'¡Orden #{orden.id} completa y lista para servir!' if orden_completa
+            else f'Producto {producto_nombre} completado. Faltan {productos_pendientes} productos.'
+        )
+        
+        return {
+            'success': True,
+            'producto_listo': True,
+            'producto_nombre': producto_nombre,
+            'orden_completa': orden_completa,
+            'productos_restantes': productos_pendientes,
+            'orden_id': orden.id,
+            'mensaje': mensaje,
+            'orden_data': obtener_datos_completos_orden(obtener_orden_con_productos(orden.id))
+        }
     
     @transaction.atomic
     def decrementar_producto(self, producto_orden_id, usuario_cocina):
@@ -115,76 +127,75 @@ class CocinaService:
             dict: Resultado de la operación
         """
         try:
-            producto_orden = OrdenProducto.objects.select_related('orden', 'producto').get(
-                id=producto_orden_id
-            )
-            
-            orden = producto_orden.orden
-            
-            # Validaciones de estado
-            if orden.estado not in ['EN_PROCESO', 'NUEVA']:
-                return {
-                    'success': False,
-                    'errores': [f'No se puede modificar orden con estado: {orden.estado}']
-                }
-            
-            if producto_orden.estado == 'LISTO':
-                return {
-                    'success': False,
-                    'errores': ['No se puede decrementar un producto ya completado']
-                }
-            
-            if producto_orden.cantidad <= 1:
-                return {
-                    'success': False,
-                    'errores': ['No se puede decrementar: solo queda 1 unidad. Usa "Marcar Listo" para completar.']
-                }
-            
-            # Ejecutar decremento
-            producto_nombre = producto_orden.producto.nombre
-            cantidad_original = producto_orden.cantidad
-            
-            # Decrementar cantidad en la orden
-            producto_orden.cantidad -= 1
-            producto_orden.save()
-            
-            # Devolver 1 unidad al inventario
-            producto = producto_orden.producto
-            producto.cantidad += 1
-            producto.save()
-            
-            # Verificar productos pendientes en la orden
-            productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
-            
-            # Notificar cambios
-            notificar_cambio_cocina()
-            notificar_cambio_stock()
-            
-            mensaje = (
-                f'{producto_nombre} decrementado: queda {producto_orden.cantidad} por preparar '
-                f'(entregaste 1 de {cantidad_original})'
-            )
-            
-            return {
-                'success': True,
-                'nueva_cantidad': producto_orden.cantidad,
-                'cantidad_entregada': cantidad_original - producto_orden.cantidad,
-                'producto_sigue_pendiente': True,
-                'mensaje': mensaje,
-                'productos_pendientes_restantes': productos_pendientes,
-                'orden_data': obtener_datos_completos_orden(orden)
-            }
-            
+            producto_orden = self._productos_orden_bloqueados().select_related(
+                'orden', 'producto'
+            ).get(id=producto_orden_id)
         except OrdenProducto.DoesNotExist:
             return {
                 'success': False,
                 'errores': ['Producto de orden no encontrado']
             }
-        except Exception as e:
+        
+        orden = producto_orden.orden
+        
+        # Validaciones de estado
+        if orden.estado not in ['EN_PROCESO', 'NUEVA']:
+            return {
+                'success': False,
+                'errores': [f'No se puede modificar orden con estado: {orden.estado}']
+            }
+        
+        if producto_orden.estado == 'LISTO':
+            return {
+                'success': False,
+                'errores': ['No se puede decrementar un producto ya completado']
+            }
+        
+        if producto_orden.cantidad <= 1:
             return {
                 'success': False,
-                'errores': [f'Error interno: {str(e)}']
+                'errores': ['No se puede decrementar: solo queda 1 unidad. Usa "Marcar Listo" para completar.']
             }
+        
+        # Ejecutar decremento
+        producto_nombre = producto_orden.producto.nombre
+        cantidad_original = producto_orden.cantidad
+        
+        # Decrementar cantidad en la orden (atómico en la BD)
+        decrementado = OrdenProducto.objects.filter(
+            id=producto_orden.id, cantidad__gt=1
+        ).update(cantidad=F('cantidad') - 1)
+        if not decrementado:
+            return {
+                'success': False,
+                'errores': ['No se puede decrementar: solo queda 1 unidad. Usa "Marcar Listo" para completar.']
+            }
+        producto_orden.refresh_from_db(fields=['cantidad'])
+        
+        # Devolver 1 unidad al inventario
+        Producto.objects.filter(id=producto_orden.producto_id).update(cantidad=F('cantidad') + 1)
+        
+        # Verificar productos pendientes en la orden
+        productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
+        
+        # Notificar cambios
+        notificar_cambio_cocina()
+        notificar_cambio_stock()
+        
+        mensaje = (
+            f'{producto_nombre} decrementado: queda {producto_orden.cantidad} por preparar '
+            f'(entregaste 1 de {cantidad_original})'
+        )
+        
+        return {
+            'success': True,
+            'nueva_cantidad': producto_orden.cantidad,
+            'cantidad_entregada': cantidad_original - producto_orden.cantidad,
+            'producto_sigue_pendiente': True,
+            'mensaje': mensaje,
+            'productos_pendientes_restantes': productos_pendientes,
+            'orden_data': obtener_datos_completos_orden(obtener_orden_con_productos(orden.id))
+        }
     
     @transaction.atomic
     def marcar_orden_completa(self, orden_id, usuario_cocina):
@@ -194,81 +205,142 @@ class CocinaService:
         """
         try:
             orden = Orden.objects.get(id=orden_id)
-            
-            if orden.estado not in self.ESTADOS_ORDEN_ACTIVA:
-                return {
-                    'success': False,
-                    'errores': [f'No se puede modificar orden con estado: {orden.estado}']
-                }
-            
-            if orden.estado == 'LISTA':
-                return {
-                    'success': False,
-                    'errores': ['La orden ya está marcada como lista']
-                }
-            
-            # Marcar todos los productos pendientes como listos
-            productos_actualizados = 0
-            productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE')
-            
-            for producto_orden in productos_pendientes:
-                producto_orden.estado = 'LISTO'
-                producto_orden.listo_en = timezone.now()
-                producto_orden.save()
-                productos_actualizados += 1
-            
-            # Marcar orden como lista si había productos pendientes
-            if productos_actualizados > 0:
-                orden.estado = 'LISTA'
-                orden.listo_en = timezone.now()
-                orden.save()
-            
-            # Notificar cambios
-            notificar_cambio_cocina()
-            
-            return {
-                'success': True,
-                'productos_actualizados': productos_actualizados,
-                'orden_completa': True,
-                'mensaje': f'Orden #{orden_id} marcada como lista con {productos_actualizados} productos actualizados'
-            }
-            
         except Orden.DoesNotExist:
             return {
                 'success': False,
                 'errores': ['Orden no encontrada']
             }
-        except Exception as e:
+        
+        if orden.estado not in self.ESTADOS_ORDEN_ACTIVA:
+            return {
+                'success': False,
+                'errores': [f'No se puede modificar orden con estado: {orden.estado}']
+            }
+        
+        if orden.estado == 'LISTA':
             return {
                 'success': False,
-                'errores': [f'Error interno: {str(e)}']
+                'errores': ['La orden ya está marcada como lista']
             }
+        
+        # Marcar todos los productos pendientes como listos (un solo UPDATE)
+        ahora = timezone.now()
+        productos_actualizados = orden.productos_ordenados.filter(
+            estado='PENDIENTE'
+        ).update(estado='LISTO', listo_en=ahora)
+        
+        # Marcar orden como lista si había productos pendientes
+        if productos_actualizados > 0:
+            orden.estado = 'LISTA'
+            orden.listo_en = ahora
+            orden.save(update_fields=['estado', 'listo_en'])
+        
+        # Notificar cambios
+        notificar_cambio_cocina()
+        
+        return {
+            'success': True,
+            'productos_actualizados': productos_actualizados,
+            'orden_completa': True,
+            'mensaje': f'Orden #{orden_id} marcada como lista con {productos_actualizados} productos actualizados'
+        }
     
     # === CONSULTAS Y REPORTES DE COCINA ===
     
-    def obtener_ordenes_activas_cocina(self):
+    def _etag_ordenes_activas(self):
+        """
+        ETag del conjunto de órdenes activas. Con caché compartida basta el contador
+        de notificaciones de cocina; con caché local se añade un resumen (cantidad,
+        última orden, último listo_en) en una sola consulta.
+        """
+        version = generar_hash_estado_cocina()
+        if cache_compartida():
+            return str(version)
+        resumen = Orden.objects.filter(estado__in=self.ESTADOS_ORDEN_ACTIVA).aggregate(
+            total=Count('id'), ultima=Max('id'), ultimo_listo=Max('listo_en')
+        )
+        ultimo_listo = resumen['ultimo_listo'].timestamp() if resumen['ultimo_listo'] else 0
+        return f"{version}-{resumen['total']}-{resumen['ultima'] or 0}-{ultimo_listo}"
+    
+    def obtener_ordenes_activas_cocina(self, etag_anterior=None):
         """
         Obtiene todas las órdenes activas para mostrar en el dashboard de cocina.
         Incluye información detallada sobre productos y tiempos.
+        Si etag_anterior coincide con el actual no hubo cambios: se devuelve
+        'cambios': False con 'ordenes' y 'total_ordenes' en None, sin reconstruir nada.
         """
         try:
-            ordenes = Orden.objects.filter(
-                estado__in=self.ESTADOS_ORDEN_ACTIVA
-            ).select_related('mesa', 'mesero').prefetch_related(
-                'productos_ordenados__producto'
-            ).order_by('creado_en')
+            etag = self._etag_ordenes_activas()
+            if etag_anterior == etag:
+                return {
+                    'success': True,
+                    'cambios': False,
+                    'etag': etag,
+                    'ordenes': None,
+                    'total_ordenes': None
+                }
+            
+            # Se cachean solo las filas; tiempo_orden se calcula en cada respuesta
+            cache_key = f'cocina_ordenes_activas:{etag}'
+            filas = cache.get(cache_key)
+            if filas is None:
+                # Dos consultas con values(): órdenes y sus productos, sin instanciar modelos
+                ordenes = list(Orden.objects.filter(
+                    estado__in=self.ESTADOS_ORDEN_ACTIVA
+                ).order_by('creado_en').values(
+                    'id', 'numero_orden', 'estado', 'observaciones', 'creado_en',
+                    'mesa__numero', 'mesero__nombre'
+                ).annotate(
+                    productos_pendientes=Count('productos_ordenados', filter=Q(productos_ordenados__estado='PENDIENTE'))
+                ))
+                
+                items = OrdenProducto.objects.filter(
+                    orden_id__in=[orden['id'] for orden in ordenes]
+                ).order_by('orden_id', 'id').values(
+                    'orden_id', 'id', 'cantidad', 'estado', 'observaciones', 'tipo_agregado', 'listo_en', 'producto__nombre'
+                ).iterator(chunk_size=500)
+                productos_por_orden = {
+                    orden_id: list(grupo) for orden_id, grupo in groupby(items, key=itemgetter('orden_id'))
+                }
+                filas = (ordenes, productos_por_orden)
+                cache.set(cache_key, filas, 60)
+            ordenes, productos_por_orden = filas
             
+            ahora = timezone.now()
             lista_ordenes = []
             for orden in ordenes:
-                try:
-                    orden_data = self._procesar_orden_para_cocina(orden)
-                    lista_ordenes.append(orden_data)
-                except Exception as e:
-                    print(f"ERROR procesando orden {orden.id} para cocina: {str(e)}")
-                    continue
+                productos = [
+                    {
+                        'id': po['id'],
+                        'nombre': po['producto__nombre'],
+                        'cantidad': po['cantidad'],
+                        'estado': po['estado'],
+                        'observaciones': self._limpiar_observaciones_producto(po['observaciones']),
+                        'agregado_despues': po['tipo_agregado'] == 'DESPUES',
+                        'listo_en': po['listo_en'].isoformat() if po['listo_en'] else None
+                    }
+                    for po in productos_por_orden.get(orden['id'], [])
+                ]
+                productos_pendientes = orden['productos_pendientes']
+                
+                lista_ordenes.append({
+                    'orden_id': orden['id'],
+                    'numero_orden': orden['numero_orden'],
+                    'mesa': orden['mesa__numero'],
+                    'mesero': orden['mesero__nombre'],
+                    'estado': orden['estado'],
+                    'observaciones': orden['observaciones'] or '',
+                    'creado_en': orden['creado_en'].isoformat(),
+                    'tiempo_orden': int((ahora - orden['creado_en']).total_seconds() / 60),
+                    'productos': productos,
+                    'productos_pendientes': productos_pendientes,
+                    'completada': productos_pendientes == 0
+                })
             
             return {
                 'success': True,
+                'cambios': True,
+                'etag': etag,
                 'ordenes': lista_ordenes,
                 'total_ordenes': len(lista_ordenes)
             }
@@ -284,18 +356,36 @@ class CocinaService:
         Obtiene productos pendientes organizados por prioridad de preparación.
         """
         try:
-            # Obtener todos los productos pendientes de órdenes activas
+            ahora = timezone.now()
+            
+            # Obtener todos los productos pendientes de órdenes activas,
+            # con la prioridad calculada en la BD: U (>30 min), N (<10 min), M (resto)
             productos_pendientes = OrdenProducto.objects.filter(
                 orden__estado__in=self.ESTADOS_ORDEN_ACTIVA,
                 estado='PENDIENTE'
-            ).select_related('orden', 'producto', 'orden__mesa', 'orden__mesero').order_by('orden__creado_en')
+            ).select_related('orden__mesa', 'orden__mesero', 'producto').only(
+                'id', 'cantidad', 'observaciones', 'tipo_agregado', 'orden', 'producto',
+                'orden__id', 'orden__creado_en', 'orden__mesa', 'orden__mesero',
+                'orden__mesa__numero', 'orden__mesero__nombre',
+                'producto__nombre', 'producto__tiempo_preparacion'
+            ).annotate(
+                prioridad=Case(
+                    When(orden__creado_en__lt=ahora - timedelta(minutes=30), then=Value('U')),
+                    When(orden__creado_en__gt=ahora - timedelta(minutes=10), then=Value('N')),
+                    default=Value('M'),
+                    output_field=CharField()
+                )
+            ).order_by('orden__creado_en')
             
             # Organizar por prioridad
             productos_urgentes = []  # Órdenes con más de 30 minutos
             productos_normales = []  # Órdenes normales
             productos_nuevos = []    # Órdenes recientes (menos de 10 minutos)
-            
-            ahora = timezone.now()
+            listas_por_prioridad = {
+                'U': productos_urgentes,
+                'M': productos_normales,
+                'N': productos_nuevos,
+            }
             
             for po in productos_pendientes:
                 tiempo_orden = (ahora - po.orden.creado_en).total_seconds() / 60  # en minutos
@@ -309,16 +399,11 @@ class CocinaService:
                     'mesa': po.orden.mesa.numero,
                     'mesero': po.orden.mesero.nombre,
                     'tiempo_orden': int(tiempo_orden),
-                    'agregado_despues': self._es_producto_agregado_despues(po),
+                    'agregado_despues': po.tipo_agregado == 'DESPUES',
                     'tiempo_preparacion_estimado': po.producto.tiempo_preparacion if hasattr(po.producto, 'tiempo_preparacion') else 15
                 }
                 
-                if tiempo_orden > 30:
-                    productos_urgentes.append(producto_info)
-                elif tiempo_orden < 10:
-                    productos_nuevos.append(producto_info)
-                else:
-                    productos_normales.append(producto_info)
+                listas_por_prioridad[po.prioridad].append(producto_info)
             
             return {
                 'success': True,
@@ -8,11 +8,11 @@ import re
 from datetime import timedelta
 from django.db import transaction
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Q, F, Case, When, PositiveIntegerField, Prefetch, Count
 
 from ..models import Orden, OrdenProducto, Mesa, Producto, Factura
 from ..utils import (
-    calcular_total_orden, obtener_datos_completos_orden,
+    calcular_total_orden_sql, obtener_datos_completos_orden,
     notificar_cambio_cocina, notificar_cambio_stock
 )
 
@@ -20,9 +20,9 @@ from ..utils import (
 class MeseroService:
     """Servicio que maneja toda la lógica de negocio específica del mesero."""
     
-    def __init__(self):
-        self.MESA_DOMICILIO = 0
-        self.MESA_RESERVA = 50
+    MESA_DOMICILIO = 0
+    MESA_RESERVA = 50
+    _MESAS_ESPECIALES = frozenset((MESA_DOMICILIO, MESA_RESERVA))
     
     # === GESTIÓN DE ÓRDENES ===
     
@@ -43,7 +43,7 @@ class MeseroService:
         try:
             # Validar mesa
             try:
-                mesa = Mesa.objects.get(id=mesa_id, is_active=True)
+                mesa = Mesa.objects.select_for_update().get(id=mesa_id, is_active=True)
             except Mesa.DoesNotExist:
                 return {
                     'success': False,
@@ -62,35 +62,35 @@ class MeseroService:
             # Validar stock y existencia de productos
             productos_validados = []
             errores_validacion = []
+            productos_map = self._productos_por_id(productos_pedido)
+            solicitado = {}  # cantidad acumulada por producto (un producto puede repetirse)
             
             for item in productos_pedido:
                 try:
-                    producto = Producto.objects.get(
-                        id=item['id'], 
-                        is_active=True, 
-                        is_available=True
-                    )
+                    producto = productos_map.get(int(item['id']))
+                    if producto is None:
+                        errores_validacion.append(f'Producto con ID {item["id"]} no encontrado')
+                        continue
                     
                     cantidad = int(item['cantidad'])
                     if cantidad <= 0:
                         errores_validacion.append(f'{producto.nombre}: Cantidad debe ser mayor a 0')
                         continue
                     
-                    if producto.cantidad < cantidad:
+                    if producto.cantidad < solicitado.get(producto.id, 0) + cantidad:
                         errores_validacion.append(
                             f'{producto.nombre}: Stock insuficiente. Disponible: {producto.cantidad}, solicitado: {cantidad}'
                         )
                         continue
                     
+                    solicitado[producto.id] = solicitado.get(producto.id, 0) + cantidad
                     productos_validados.append({
                         'producto': producto,
                         'cantidad': cantidad,
-                        'observaciones': item.get('observaciones', '').strip()
+                        'observaciones': (item.get('observaciones') or '').strip()
                     })
                     
-                except Producto.DoesNotExist:
-                    errores_validacion.append(f'Producto con ID {item["id"]} no encontrado')
-                except (ValueError, KeyError):
+                except (ValueError, KeyError, TypeError):
                     errores_validacion.append(f'Datos inválidos para producto {item.get("id", "desconocido")}')
             
             if errores_validacion:
@@ -101,7 +101,7 @@ class MeseroService:
                 }
             
             # Verificar disponibilidad de mesa para mesas físicas
-            if mesa.numero not in [self.MESA_DOMICILIO, self.MESA_RESERVA]:
+            if self._es_fisica(mesa.numero):
                 if mesa.estado != 'LIBRE':
                     return {
                         'success': False,
@@ -117,31 +117,26 @@ class MeseroService:
                 observaciones=observaciones_orden
             )
             
-            # Agregar productos y actualizar stock
-            productos_creados = []
-            for item_validado in productos_validados:
-                producto = item_validado['producto']
-                cantidad = item_validado['cantidad']
-                observaciones = item_validado['observaciones']
-                
-                producto_orden = OrdenProducto.objects.create(
+            # Agregar productos (un solo INSERT) y actualizar stock
+            productos_creados = OrdenProducto.objects.bulk_create([
+                OrdenProducto(
                     orden=nueva_orden,
-                    producto=producto,
-                    cantidad=cantidad,
-                    precio_unitario=producto.precio,
-                    observaciones=observaciones,
+                    producto=item_validado['producto'],
+                    cantidad=item_validado['cantidad'],
+                    precio_unitario=item_validado['producto'].precio,
+                    observaciones=item_validado['observaciones'],
                     estado='PENDIENTE'
                 )
-                productos_creados.append(producto_orden)
-                
-                # Actualizar stock
-                producto.cantidad -= cantidad
-                producto.save()
+                for item_validado in productos_validados
+            ], batch_size=500)
+            
+            # Actualizar stock
+            self._descontar_stock(productos_validados)
             
             # Ocupar mesa si es física
-            if mesa.numero not in [self.MESA_DOMICILIO, self.MESA_RESERVA]:
+            if self._es_fisica(mesa.numero):
                 mesa.estado = 'OCUPADA'
-                mesa.save()
+                mesa.save(update_fields=['estado'])
             
             # Notificar cambios
             notificar_cambio_cocina()
@@ -168,10 +163,10 @@ class MeseroService:
         Maneja automáticamente órdenes con factura pendiente.
         """
         try:
-            orden = Orden.objects.get(id=orden_id)
+            orden = Orden.objects.select_related('factura').get(id=orden_id)
             
             # Verificar permisos
-            if orden.mesero != mesero and not mesero.is_superuser:
+            if orden.mesero_id != mesero.id and not mesero.is_superuser:
                 return {
                     'success': False,
                     'errores': ['Solo puedes modificar tus propias órdenes']
@@ -198,31 +193,36 @@ class MeseroService:
             # Validar productos nuevos
             productos_validados = []
             errores_validacion = []
+            productos_map = self._productos_por_id(productos_nuevos)
+            solicitado = {}  # cantidad acumulada por producto (un producto puede repetirse)
             
             for item in productos_nuevos:
                 try:
-                    producto = Producto.objects.get(id=item['id'], is_active=True, is_available=True)
+                    producto = productos_map.get(int(item['id']))
+                    if producto is None:
+                        errores_validacion.append(f'Producto con ID {item["id"]} no encontrado')
+                        continue
+                    
                     cantidad = int(item['cantidad'])
                     
                     if cantidad <= 0:
                         errores_validacion.append(f'{producto.nombre}: Cantidad inválida')
                         continue
                     
-                    if producto.cantidad < cantidad:
+                    if producto.cantidad < solicitado.get(producto.id, 0) + cantidad:
                         errores_validacion.append(
                             f'{producto.nombre}: Stock insuficiente. Disponible: {producto.cantidad}'
                         )
                         continue
                     
+                    solicitado[producto.id] = solicitado.get(producto.id, 0) + cantidad
                     productos_validados.append({
                         'producto': producto,
                         'cantidad': cantidad,
-                        'observaciones': item.get('observaciones', '').strip()
+                        'observaciones': (item.get('observaciones') or '').strip()
                     })
                     
-                except Producto.DoesNotExist:
-                    errores_validacion.append(f'Producto con ID {item["id"]} no encontrado')
-                except (ValueError, KeyError):
+                except (ValueError, KeyError, TypeError):
                     errores_validacion.append(f'Datos inválidos para producto {item.get("id")}')
             
             if errores_validacion:
@@ -231,62 +231,53 @@ class MeseroService:
                     'errores': errores_validacion
                 }
             
-            # Determinar marcador según tipo de modificación
+            # Determinar tipo de registro según tipo de modificación
             if tiene_factura_pendiente:
-                marcador_obs = "AGREGADO_POST_FACTURA"
+                tipo_registro = 'POST_FACTURA'
                 tipo_agregado = "post-factura"
             else:
-                marcador_obs = "AGREGADO_DESPUES"
+                tipo_registro = 'DESPUES'
                 tipo_agregado = "después de creación"
             
             # Agregar productos
-            productos_agregados = []
+            nuevos_productos_orden = []
             total_agregado = 0
             
             for item_validado in productos_validados:
                 producto = item_validado['producto']
                 cantidad = item_validado['cantidad']
-                observaciones_usuario = item_validado['observaciones']
                 
-                # Preparar observaciones finales
-                if observaciones_usuario:
-                    obs_final = f"{marcador_obs}|{observaciones_usuario}"
-                else:
-                    obs_final = marcador_obs
-                
-                # Crear OrdenProducto
-                nuevo_producto_orden = OrdenProducto.objects.create(
+                nuevos_productos_orden.append(OrdenProducto(
                     orden=orden,
                     producto=producto,
                     cantidad=cantidad,
                     precio_unitario=producto.precio,
-                    observaciones=obs_final,
+                    observaciones=item_validado['observaciones'],
+                    tipo_agregado=tipo_registro,
                     estado='PENDIENTE'
-                )
-                
-                productos_agregados.append(nuevo_producto_orden)
+                ))
                 total_agregado += cantidad * producto.precio
-                
-                # Actualizar stock
-                producto.cantidad -= cantidad
-                producto.save()
+            
+            # Crear OrdenProducto (un solo INSERT) y actualizar stock
+            productos_agregados = OrdenProducto.objects.bulk_create(nuevos_productos_orden, batch_size=500)
+            self._descontar_stock(productos_validados)
             
             # Actualizar factura si existe
             nueva_factura_total = None
             if tiene_factura_pendiente and factura:
                 factura.subtotal += total_agregado
                 factura.total += total_agregado
-                factura.save()
+                factura.save(update_fields=['subtotal', 'total'])
                 nueva_factura_total = float(factura.total)
             
             # Actualizar estado de la orden
             if orden.estado == 'LISTA':
                 orden.estado = 'EN_PROCESO'
                 orden.listo_en = None
-                orden.save()
+                orden.save(update_fields=['estado', 'listo_en'])
             elif orden.estado == 'SERVIDA' and tiene_factura_pendiente:
                 orden.estado = 'EN_PROCESO'
-                orden.save()
+                orden.save(update_fields=['estado'])
             
             # Notificar cambios
             notificar_cambio_cocina()
@@ -320,7 +311,7 @@ class MeseroService:
             orden = Orden.objects.get(id=orden_id)
             
             # Verificar permisos
-            if orden.mesero != mesero and not mesero.is_superuser:
+            if orden.mesero_id != mesero.id and not mesero.is_superuser:
                 return {
                     'success': False,
                     'errores': ['Solo puedes marcar como lista tus propias órdenes']
@@ -338,18 +329,16 @@ class MeseroService:
                     'errores': ['No se puede modificar una orden ya servida']
                 }
             
-            # Marcar todos los productos como listos
-            productos_actualizados = 0
-            for producto_orden in orden.productos_ordenados.filter(estado='PENDIENTE'):
-                producto_orden.estado = 'LISTO'
-                producto_orden.listo_en = timezone.now()
-                producto_orden.save()
-                productos_actualizados += 1
+            # Marcar todos los productos como listos (un solo UPDATE)
+            ahora = timezone.now()
+            productos_actualizados = orden.productos_ordenados.filter(
+                estado='PENDIENTE'
+            ).update(estado='LISTO', listo_en=ahora)
             
             # Marcar orden como lista
             orden.estado = 'LISTA'
-            orden.listo_en = timezone.now()
-            orden.save()
+            orden.listo_en = ahora
+            orden.save(update_fields=['estado', 'listo_en'])
             
             # Notificar cambios
             notificar_cambio_cocina()
@@ -375,10 +364,10 @@ class MeseroService:
     def entregar_orden(self, orden_id, mesero):
         """Marca una orden como entregada y genera/actualiza su factura."""
         try:
-            orden = Orden.objects.get(id=orden_id)
+            orden = Orden.objects.select_related('mesa').get(id=orden_id)
             
             # Verificar permisos
-            if orden.mesero != mesero and not mesero.is_superuser:
+            if orden.mesero_id != mesero.id and not mesero.is_superuser:
                 return {
                     'success': False,
                     'errores': ['Solo puedes entregar tus propias órdenes']
@@ -390,45 +379,36 @@ class MeseroService:
                     'errores': [f'La orden debe estar LISTA para entregarla. Estado actual: {orden.estado}']
                 }
             
-            # Verificar que todos los productos estén listos
-            productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
-            if productos_pendientes > 0:
+            # Verificar que todos los productos estén listos (solo se cuenta si hay pendientes)
+            pendientes_qs = orden.productos_ordenados.filter(estado='PENDIENTE')
+            if pendientes_qs.exists():
                 return {
                     'success': False,
-                    'errores': [f'Aún hay {productos_pendientes} productos pendientes']
+                    'errores': [f'Aún hay {pendientes_qs.count()} productos pendientes']
                 }
             
             # Calcular total
-            total_orden = calcular_total_orden(orden)
+            total_orden = calcular_total_orden_sql(orden.id)
             
             # Marcar como servida
             orden.estado = 'SERVIDA'
-            orden.save()
+            orden.save(update_fields=['estado'])
             
             # Liberar la mesa si es física
             mesa = orden.mesa
-            if mesa.numero not in [self.MESA_DOMICILIO, self.MESA_RESERVA]:
+            if self._es_fisica(mesa.numero):
                 mesa.estado = 'LIBRE'
-                mesa.save()
-            
-            # Gestionar factura
-            try:
-                # Intentar obtener factura existente
-                factura = Factura.objects.get(orden=orden)
-                factura.estado_pago = 'NO_PAGADA'
-                factura.subtotal = total_orden
-                factura.total = total_orden
-                factura.save()
-                factura_creada = False
-            except Factura.DoesNotExist:
-                # Crear nueva factura
-                factura = Factura.objects.create(
-                    orden=orden,
-                    subtotal=total_orden,
-                    total=total_orden,
-                    estado_pago='NO_PAGADA'
-                )
-                factura_creada = True
+                mesa.save(update_fields=['estado'])
+            
+            # Gestionar factura (actualizar la existente o crearla)
+            factura, factura_creada = Factura.objects.update_or_create(
+                orden=orden,
+                defaults={
+                    'subtotal': total_orden,
+                    'total': total_orden,
+                    'estado_pago': 'NO_PAGADA'
+                }
+            )
             
             # Notificar cambios
             notificar_cambio_cocina()
@@ -437,7 +417,7 @@ class MeseroService:
                 'success': True,
                 'factura_id': factura.id,
                 'factura_creada': factura_creada,
-                'mesa_liberada': mesa.numero not in [self.MESA_DOMICILIO, self.MESA_RESERVA],
+                'mesa_liberada': self._es_fisica(mesa.numero),
                 'total': float(total_orden),
                 'mensaje': f'Orden #{orden_id} entregada exitosamente'
             }
@@ -461,18 +441,19 @@ class MeseroService:
             ordenes = Orden.objects.filter(
                 mesero=mesero,
                 estado__in=['EN_PROCESO', 'LISTA']
+            ).select_related('mesa', 'mesero').prefetch_related(
+                Prefetch('productos_ordenados', queryset=OrdenProducto.objects.select_related('producto'))
             ).order_by('-creado_en')
             
             ordenes_data = []
             for orden in ordenes:
                 orden_data = obtener_datos_completos_orden(orden)
                 
-                # Agregar información específica del mesero
-                productos_listos = orden.productos_ordenados.filter(estado='LISTO').count()
-                productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
-                productos_agregados = orden.productos_ordenados.filter(
-                    observaciones__icontains='AGREGADO_DESPUES'
-                ).count()
+                # Agregar información específica del mesero (sobre los productos ya precargados)
+                productos = orden.productos_ordenados.all()
+                productos_listos = sum(1 for p in productos if p.estado == 'LISTO')
+                productos_pendientes = sum(1 for p in productos if p.estado == 'PENDIENTE')
+                productos_agregados = sum(1 for p in productos if p.tipo_agregado == 'DESPUES')
                 
                 orden_data.update({
                     'tiene_productos_listos': productos_listos > 0,
@@ -541,7 +522,9 @@ class MeseroService:
                 ordenes_query = ordenes_query.filter(creado_en__gte=fecha_limite)
             
             # Ordenar y limitar
-            ordenes = ordenes_query.order_by('-creado_en')[:50]
+            ordenes = ordenes_query.select_related('mesa', 'mesero', 'factura').prefetch_related(
+                Prefetch('productos_ordenados', queryset=OrdenProducto.objects.select_related('producto'))
+            ).order_by('-creado_en')[:50]
             
             ordenes_data = []
             for orden in ordenes:
@@ -570,13 +553,18 @@ class MeseroService:
             mesas_fisicas = Mesa.objects.filter(
                 is_active=True,
                 estado='OCUPADA'
-            ).exclude(numero__in=[self.MESA_DOMICILIO, self.MESA_RESERVA])
+            ).exclude(numero__in=self._MESAS_ESPECIALES)
+            
+            # Órdenes activas de todas esas mesas en una sola consulta (la primera por mesa)
+            orden_por_mesa = {}
+            for orden in Orden.objects.filter(
+                mesa__in=mesas_fisicas,
+                estado__in=['EN_PROCESO', 'LISTA', 'NUEVA']
+            ).annotate(productos_count=Count('productos_ordenados')).order_by('id'):
+                orden_por_mesa.setdefault(orden.mesa_id, orden)
             
             for mesa in mesas_fisicas:
-                orden = Orden.objects.filter(
-                    mesa=mesa,
-                    estado__in=['EN_PROCESO', 'LISTA', 'NUEVA']
-                ).first()
+                orden = orden_por_mesa.get(mesa.id)
                 
                 if orden:
                     mesas_data.append({
@@ -584,7 +572,7 @@ class MeseroService:
                         'numero': mesa.numero,
                         'ubicacion': mesa.ubicacion,
                         'capacidad': mesa.capacidad,
-                        'productos_count': orden.productos_ordenados.count(),
+                        'productos_count': orden.productos_count,
                         'tiene_orden': True,
                         'orden_id': orden.id,
                         'es_domicilio': False,
@@ -595,13 +583,13 @@ class MeseroService:
             # Mesas especiales (domicilio y reservas)
             mesas_especiales = Mesa.objects.filter(
                 is_active=True,
-                numero__in=[self.MESA_DOMICILIO, self.MESA_RESERVA]
+                numero__in=self._MESAS_ESPECIALES
             )
             
             for mesa_especial in mesas_especiales:
-                ordenes_activas = self._obtener_ordenes_activas_mesa_especial(mesa_especial)
+                ordenes_activas = list(self._obtener_ordenes_activas_mesa_especial(mesa_especial))
                 
-                if ordenes_activas.exists():
+                if ordenes_activas:
                     for i, orden in enumerate(ordenes_activas):
                         mesa_info = self._crear_info_mesa_especial(
                             mesa_especial, orden, i, incluir_detalle_cliente
@@ -638,16 +626,23 @@ class MeseroService:
     def obtener_orden_por_mesa(self, mesa_id):
         """Obtiene la orden activa de una mesa específica."""
         try:
-            mesa = Mesa.objects.get(id=mesa_id, is_active=True)
-            
-            # Buscar orden activa O servida con factura no pagada
-            orden = Orden.objects.filter(
-                Q(mesa=mesa) & 
-                (Q(estado__in=['EN_PROCESO', 'LISTA', 'NUEVA']) | 
-                 Q(estado='SERVIDA', factura__estado_pago__in=['NO_PAGADA', 'PARCIAL']))
-            ).distinct().first()
+            # Buscar orden activa O servida con factura no pagada (Orden-Factura es 1:1, sin DISTINCT)
+            orden = Orden.objects.select_related('mesa', 'mesero', 'factura').prefetch_related(
+                Prefetch('productos_ordenados', queryset=OrdenProducto.objects.select_related('producto'))
+            ).filter(
+                mesa_id=mesa_id, mesa__is_active=True
+            ).filter(
+                Q(estado__in=['EN_PROCESO', 'LISTA', 'NUEVA']) | 
+                Q(estado='SERVIDA', factura__estado_pago__in=['NO_PAGADA', 'PARCIAL'])
+            ).order_by('-creado_en').first()
             
             if not orden:
+                # La mesa solo se consulta cuando no hay orden, para distinguir el error
+                if not Mesa.objects.filter(id=mesa_id, is_active=True).exists():
+                    return {
+                        'success': False,
+                        'errores': ['Mesa no encontrada']
+                    }
                 return {
                     'success': False,
                     'errores': ['No hay orden activa o con pago pendiente en esta mesa']
@@ -656,25 +651,20 @@ class MeseroService:
             # Obtener datos completos de la orden
             orden_data = obtener_datos_completos_orden(orden)
             
-            # Verificar si tiene factura pendiente
-            tiene_factura_pendiente = False
-            try:
-                if orden.factura.estado_pago in ['NO_PAGADA', 'PARCIAL']:
-                    tiene_factura_pendiente = True
-            except:
-                pass
+            # Verificar si tiene factura pendiente (factura ya viene en el JOIN)
+            tiene_factura_pendiente = (
+                hasattr(orden, 'factura') and orden.factura.estado_pago in ['NO_PAGADA', 'PARCIAL']
+            )
             
             orden_data['tiene_factura_pendiente'] = tiene_factura_pendiente
             
-            # Separar productos originales de agregados
+            # Separar productos originales de agregados (tipo de los productos precargados)
             productos_originales = []
             productos_agregados = []
+            tipo_por_id = {po.id: po.tipo_agregado for po in orden.productos_ordenados.all()}
             
             for producto_data in orden_data['productos']:
-                producto_orden = OrdenProducto.objects.get(id=producto_data['id'])
-                if (producto_orden.observaciones and 
-                    ('AGREGADO_DESPUES' in producto_orden.observaciones or 
-                     'AGREGADO_POST_FACTURA' in producto_orden.observaciones)):
+                if tipo_por_id.get(producto_data['id'], 'ORIGINAL') != 'ORIGINAL':
                     producto_data['agregado_despues'] = True
                     productos_agregados.append(producto_data)
                 else:
@@ -689,11 +679,6 @@ class MeseroService:
                 'orden': orden_data
             }
             
-        except Mesa.DoesNotExist:
-            return {
-                'success': False,
-                'errores': ['Mesa no encontrada']
-            }
         except Exception as e:
             return {
                 'success': False,
@@ -702,24 +687,47 @@ class MeseroService:
     
     # === MÉTODOS PRIVADOS DE APOYO ===
     
-    def _obtener_ordenes_activas_mesa_especial(self, mesa):
-        """Obtiene órdenes activas de una mesa especial (domicilio/reserva)."""
-        ordenes_activas = Orden.objects.filter(
-            mesa=mesa,
-            estado__in=['EN_PROCESO', 'LISTA', 'NUEVA']
-        )
+    def _es_fisica(self, numero):
+        """Indica si el número corresponde a una mesa física (no domicilio ni reserva)."""
+        return numero not in self._MESAS_ESPECIALES
+    
+    def _productos_por_id(self, items):
+        """
+        Carga en una sola consulta los productos activos y disponibles del pedido,
+        bloqueando sus filas hasta el fin de la transacción para que la validación
+        de stock y el descuento no se crucen con otro pedido.
+        """
+        ids = set()
+        for item in items:
+            try:
+                ids.add(int(item['id']))
+            except (ValueError, KeyError, TypeError):
+                continue
+        productos = Producto.objects.select_for_update().filter(
+            id__in=ids, is_active=True, is_available=True
+        ).order_by('id')
+        return {producto.id: producto for producto in productos}
+    
+    def _descontar_stock(self, productos_validados):
+        """Descuenta del inventario las cantidades pedidas con un solo UPDATE."""
+        cantidades = {}
+        for item in productos_validados:
+            producto_id = item['producto'].id
+            cantidades[producto_id] = cantidades.get(producto_id, 0) + item['cantidad']
         
-        try:
-            ordenes_no_pagadas = Orden.objects.filter(
-                mesa=mesa,
-                estado='SERVIDA'
-            ).filter(
-                factura__estado_pago__in=['NO_PAGADA', 'PARCIAL']
-            )
-            
-            return ordenes_activas.union(ordenes_no_pagadas).order_by('-creado_en')
-        except Exception:
-            return ordenes_activas.order_by('-creado_en')
+        if cantidades:
+            Producto.objects.filter(id__in=cantidades).update(cantidad=Case(
+                *[When(id=producto_id, then=F('cantidad') - cantidad) for producto_id, cantidad in cantidades.items()],
+                default=F('cantidad'),
+                output_field=PositiveIntegerField()
+            ))
+    
+    def _obtener_ordenes_activas_mesa_especial(self, mesa):
+        """Obtiene órdenes activas o servidas con factura pendiente de una mesa especial (domicilio/reserva)."""
+        return Orden.objects.filter(mesa=mesa).filter(
+            Q(estado__in=['EN_PROCESO', 'LISTA', 'NUEVA']) |
+            Q(estado='SERVIDA', factura__estado_pago__in=['NO_PAGADA', 'PARCIAL'])
+        ).select_related('factura').order_by('-creado_en')
     
     def _crear_info_mesa_especial(self, mesa, orden, index, incluir_detalle_cliente):
         """Crea la información de una mesa especial con orden."""
@@ -1,20 +1,28 @@
 # core/signals.py
-from django.db.models.signals import post_save
+from decimal import Decimal
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Orden, Factura
-from .utils import calcular_total_orden  # ✅ IMPORTAR FUNCIÓN UTILITARIA
+from .models import Usuario, CategoriaProducto, Mesa, Orden, OrdenProducto, Producto, Factura
+from .decorators import user_groups_cache_key
+from .forms import choices_cache_key
+from .utils import calcular_total_orden, notificar_cambio_cocina, notificar_cambio_stock  # ✅ IMPORTAR FUNCIÓN UTILITARIA
 
 @receiver(post_save, sender=Orden)
-def crear_o_actualizar_factura(sender, instance, created, **kwargs):
+def crear_o_actualizar_factura(sender, instance, created, update_fields=None, **kwargs):
     """
     Se activa cada vez que se guarda una Orden.
     Si el estado de la Orden es 'LISTA', crea su factura si no existe.
     """
-    # Solo procesar si la orden está 'LISTA'
+    # Guardados parciales que no tocan el estado no afectan la factura
+    if update_fields and 'estado' not in update_fields:
+        return
+    
+    # Solo procesar si la orden está 'LISTA' (antes de cualquier consulta)
     if instance.estado == 'LISTA':
         try:
             # ✅ CORREGIDO: Intentar obtener factura existente primero
-            factura = Factura.objects.filter(orden=instance).first()
+            factura = Factura.objects.filter(orden_id=instance.id).only('id', 'subtotal', 'total').first()
             
             if not factura:
                 # Solo crear si no existe
@@ -30,11 +38,52 @@ def crear_o_actualizar_factura(sender, instance, created, **kwargs):
             else:
                 # Si ya existe, solo actualizar el total si es necesario
                 total_orden = calcular_total_orden(instance)
-                if factura.total != total_orden:
+                if abs(factura.total - total_orden) >= Decimal('0.01'):
                     factura.subtotal = total_orden
                     factura.total = total_orden
-                    factura.save()
+                    factura.save(update_fields=['subtotal', 'total'])
                     print(f"✅ Factura actualizada para la Orden #{instance.id}")
                     
         except Exception as e:
-            print(f"❌ Error gestionando factura para orden {instance.id}: {str(e)}")
\ No newline at end of file
+            print(f"❌ Error gestionando factura para orden {instance.id}: {str(e)}")
+
+
+@receiver(m2m_changed, sender=Usuario.groups.through)
+def invalidar_cache_grupos(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalida la cache de grupos usada por group_required cuando cambian
+    los grupos de un usuario (o los usuarios de un grupo).
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            cache.delete(user_groups_cache_key(instance.pk))
+        return
+
+    # instance es un Group: hay que invalidar a cada usuario afectado
+    if action == 'pre_clear':
+        user_ids = instance.user_set.values_list('id', flat=True)
+    elif action in ('post_add', 'post_remove'):
+        user_ids = pk_set
+    else:
+        return
+    cache.delete_many([user_groups_cache_key(user_id) for user_id in user_ids])
+
+
+@receiver([post_save, post_delete], sender=CategoriaProducto)
+@receiver([post_save, post_delete], sender=Mesa)
+def invalidar_cache_opciones(sender, **kwargs):
+    """Invalida los desplegables cacheados (CachedModelChoiceField) del modelo."""
+    cache.delete(choices_cache_key(sender))
+
+
+@receiver([post_save, post_delete], sender=Orden)
+@receiver([post_save, post_delete], sender=OrdenProducto)
+def versionar_estado_cocina(sender, **kwargs):
+    """Incrementa la versión de cocina que consulta el long polling."""
+    notificar_cambio_cocina()
+
+
+@receiver([post_save, post_delete], sender=Producto)
+def versionar_stock(sender, **kwargs):
+    """Incrementa la versión de stock que consulta el long polling de meseros."""
+    notificar_cambio_stock()
@@ -1,3 +1,508 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.admin.models import LogEntry
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import ResolverMatch
+
+from .admin import es_changelist
+from .decorators import DebounceMiddleware, acquire_debounce, debounce_cache
+from .models import CategoriaProducto, Factura, Mesa, Orden, OrdenProducto, Producto, Usuario
+from .reservas_utils import ReservasManager
+from .utils import (
+    CLAVE_VERSION_COCINA, CLAVE_VERSION_STOCK, _leer_version, generar_hash_estado_cocina,
+    generar_hash_stock, long_polling_cocina, notificar_cambio_cocina,
+)
+
+# cajero_service y cocina_service pueden no importar si el paquete de servicios está incompleto
+try:
+    from .services.cajero_service import CajeroService
+    from .services.cocina_service import CocinaService
+    from .services.mesero_service import MeseroService
+    SERVICIOS_DISPONIBLES = True
+except SyntaxError:
+    SERVICIOS_DISPONIBLES = False
+
+
+class AcquireDebounceTests(TestCase):
+    """acquire_debounce: una sola request gana cada ventana de debounce."""
+
+    def setUp(self):
+        debounce_cache.clear()
+
+    def test_primera_request_permitida(self):
+        self.assertEqual(acquire_debounce('debounce_t', 0.5, 100.0), 0)
+
+    def test_request_dentro_del_delay_rechazada(self):
+        acquire_debounce('debounce_t', 0.5, 100.0)
+        restante = acquire_debounce('debounce_t', 0.5, 100.2)
+        self.assertAlmostEqual(restante, 0.3)
+
+    def test_clave_expirada_se_permite(self):
+        acquire_debounce('debounce_t', 0.5, 100.0)
+        debounce_cache.delete('debounce_t')
+        self.assertEqual(acquire_debounce('debounce_t', 0.5, 101.0), 0)
+
+    def test_ventana_de_redondeo_solo_una_request_renueva(self):
+        # delay 0.5 s vive 1 s en cache: entre 0.5 y 1 s dos requests compiten
+        acquire_debounce('debounce_t', 0.5, 100.0)
+        self.assertEqual(acquire_debounce('debounce_t', 0.5, 100.7), 0)
+        self.assertGreater(acquire_debounce('debounce_t', 0.5, 100.7), 0)
+        # La renovación cuenta como nueva request
+        self.assertGreater(acquire_debounce('debounce_t', 0.5, 100.9), 0)
+
+
+class DebounceMiddlewareTests(TestCase):
+    """DebounceMiddleware comparte acquire_debounce: un solo POST pasa por ventana."""
+
+    def setUp(self):
+        debounce_cache.clear()
+        self.usuario = Usuario.objects.create_user('mw@test.com', 'Mesero', 'x')
+        self.middleware = DebounceMiddleware(lambda request: HttpResponse('ok'))
+
+    def _post(self):
+        request = RequestFactory().post('/api/orden/crear/')
+        request.user = self.usuario
+        return self.middleware(request)
+
+    def test_post_repetido_rechazado(self):
+        with mock.patch('core.decorators.time.time', return_value=100.0):
+            self.assertEqual(self._post().status_code, 200)
+        with mock.patch('core.decorators.time.time', return_value=100.2):
+            self.assertEqual(self._post().status_code, 429)
+
+    def test_ventana_de_redondeo_sin_carrera(self):
+        with mock.patch('core.decorators.time.time', return_value=100.0):
+            self._post()
+        with mock.patch('core.decorators.time.time', return_value=100.7):
+            self.assertEqual(self._post().status_code, 200)
+            self.assertEqual(self._post().status_code, 429)
+
+
+class EventosSseTests(TestCase):
+    """Los endpoints SSE solo transmiten bajo ASGI con cache compartida; si no, 204 y long polling."""
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create_superuser('sse@test.com', 'Admin', 'x')
+        self.client.force_login(self.usuario)
+
+    def test_wsgi_responde_204(self):
+        self.assertEqual(self.client.get('/api/eventos/cocina/').status_code, 204)
+        self.assertEqual(self.client.get('/api/eventos/meseros/').status_code, 204)
+
+    def test_dashboard_wsgi_desactiva_sse(self):
+        respuesta = self.client.get('/dashboard/cocinero/')
+        self.assertContains(respuesta, 'const sseDisponible = false')
+
+    async def test_asgi_con_cache_local_responde_204(self):
+        cliente = AsyncClient()
+        await cliente.aforce_login(self.usuario)
+        respuesta = await cliente.get('/api/eventos/cocina/')
+        self.assertEqual(respuesta.status_code, 204)
+
+    async def test_asgi_con_cache_compartida_transmite_eventos(self):
+        cliente = AsyncClient()
+        await cliente.aforce_login(self.usuario)
+        with mock.patch('core.utils.cache_compartida', return_value=True):
+            respuesta = await cliente.get('/api/eventos/cocina/')
+            self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+            primer_evento = await respuesta.streaming_content.__aiter__().__anext__()
+        self.assertTrue(primer_evento.startswith(b'id: '))
+        self.assertIn(b'event: cocina', primer_evento)
+
+
+@skipUnless(SERVICIOS_DISPONIBLES, 'core.services no importa en este árbol')
+class FacturasPendientesTests(TestCase):
+    """obtener_facturas_pendientes: forma de cada factura que recibe el cajero."""
+
+    def test_claves_de_factura(self):
+        mesero = Usuario.objects.create_user('mesero@test.com', 'Mesero', 'x')
+        mesa = Mesa.objects.create(numero=1, capacidad=4, ubicacion='Salón')
+        orden = Orden.objects.create(mesero=mesero, mesa=mesa)
+        factura = Factura.objects.create(orden=orden, subtotal=Decimal('10'), total=Decimal('10'))
+
+        resultado = CajeroService().obtener_facturas_pendientes()
+
+        self.assertTrue(resultado['success'])
+        self.assertEqual(resultado['facturas'], [{
+            'id': factura.id,
+            'numero_factura': f'FAC-{factura.id:06d}',
+            'total': 10.0,
+            'estado_pago': 'NO_PAGADA',
+            'creado_en': factura.creado_en.isoformat(),
+            'orden_id': orden.id,
+            'mesa': 1,
+            'mesero': 'Mesero',
+        }])
+
+
+class AdminChangelistTests(TestCase):
+    """Las listas del admin hacen las mismas consultas con 1 fila que con muchas."""
+
+    def setUp(self):
+        self.admin = Usuario.objects.create_superuser('admin@test.com', 'Admin', 'x')
+        self.client.force_login(self.admin)
+        self.categoria = CategoriaProducto.objects.create(nombre='Bebidas')
+
+    def _crear_filas(self, desde, hasta):
+        for n in range(desde, hasta):
+            mesa = Mesa.objects.create(numero=n, capacidad=4, ubicacion='Salón')
+            Orden.objects.create(mesero=self.admin, mesa=mesa)
+            Producto.objects.create(nombre=f'Producto {n}', precio=Decimal('1'), id_categoria=self.categoria)
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(consultas)
+
+    def test_consultas_constantes(self):
+        urls = ('/admin/core/orden/', '/admin/core/producto/')
+        self._crear_filas(1, 2)
+        pocas = [self._consultas(url) for url in urls]
+        self._crear_filas(2, 12)
+        self.assertEqual([self._consultas(url) for url in urls], pocas)
+
+    def test_es_changelist_sin_url_name(self):
+        request = RequestFactory().get('/')
+        request.resolver_match = ResolverMatch(lambda r: None, (), {}, url_name=None)
+        self.assertFalse(es_changelist(request))
+        request.resolver_match = ResolverMatch(lambda r: None, (), {}, url_name='core_orden_changelist')
+        self.assertTrue(es_changelist(request))
+
+
+class OrdenAdminFormsetTests(TestCase):
+    """OrdenAdmin.save_formset: filas nuevas con pk y aviso a la cocina al confirmar."""
+
+    def setUp(self):
+        self.admin = Usuario.objects.create_superuser('admin@test.com', 'Admin', 'x')
+        self.client.force_login(self.admin)
+        categoria = CategoriaProducto.objects.create(nombre='Platos')
+        self.producto = Producto.objects.create(nombre='Bandeja', precio=Decimal('12'), id_categoria=categoria)
+        self.mesa = Mesa.objects.create(numero=1, capacidad=4, ubicacion='Salón')
+
+    def _datos(self, **extra):
+        datos = {
+            'mesero': self.admin.id, 'mesa': self.mesa.id, 'estado': 'NUEVA', 'observaciones': '',
+            'productos_ordenados-TOTAL_FORMS': '1', 'productos_ordenados-INITIAL_FORMS': '0',
+            'productos_ordenados-0-producto': self.producto.id, 'productos_ordenados-0-cantidad': '2',
+            'productos_ordenados-0-estado': 'PENDIENTE', 'productos_ordenados-0-tipo_agregado': 'ORIGINAL',
+        }
+        datos.update(extra)
+        return datos
+
+    def test_alta_con_productos(self):
+        version = _leer_version(CLAVE_VERSION_COCINA)
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post('/admin/core/orden/add/', self._datos())
+        self.assertEqual(respuesta.status_code, 302)
+
+        linea = OrdenProducto.objects.get()
+        self.assertEqual(linea.precio_unitario, Decimal('12'))
+        # El historial del admin guarda la fila nueva con su pk
+        mensaje = LogEntry.objects.get().change_message
+        self.assertIn(f'OrdenProducto object ({linea.pk})', mensaje)
+        self.assertGreater(_leer_version(CLAVE_VERSION_COCINA), version)
+
+    def test_modificacion_en_lote_avisa_a_cocina(self):
+        orden = Orden.objects.create(mesero=self.admin, mesa=self.mesa)
+        linea = OrdenProducto.objects.create(
+            orden=orden, producto=self.producto, cantidad=1, precio_unitario=Decimal('12')
+        )
+        # bulk_update no dispara post_save: el aviso lo hace save_formset
+        with mock.patch('core.admin.notificar_cambio_cocina') as notificar:
+            respuesta = self.client.post(f'/admin/core/orden/{orden.id}/change/', self._datos(**{
+                'productos_ordenados-INITIAL_FORMS': '1', 'productos_ordenados-0-id': linea.id,
+                'productos_ordenados-0-orden': orden.id, 'productos_ordenados-0-cantidad': '3',
+            }))
+        self.assertEqual(respuesta.status_code, 302)
+        linea.refresh_from_db()
+        self.assertEqual(linea.cantidad, 3)
+        notificar.assert_called_once_with()
+
+
+class ReservasTests(TestCase):
+    """ReservasManager: cambios de estado de reservas y de sus mesas."""
+
+    def setUp(self):
+        self.mesero = Usuario.objects.create_user('mesero@test.com', 'Mesero', 'x')
+        self.mesa = Mesa.objects.create(numero=7, capacidad=4, ubicacion='Terraza')
+
+    def _reserva(self, reserva_data=None):
+        return Orden.objects.create(
+            mesero=self.mesero, mesa=self.mesa, es_reserva=True,
+            reserva_data={'estado_reserva': 'PENDIENTE'} if reserva_data is None else reserva_data
+        )
+
+    def test_bulk_cuenta_solo_reservas_actualizadas(self):
+        valida = self._reserva()
+        sin_datos = Orden.objects.create(mesero=self.mesero, mesa=self.mesa, es_reserva=True)
+        no_reserva = Orden.objects.create(mesero=self.mesero, mesa=self.mesa)
+
+        actualizadas = ReservasManager.bulk_actualizar_estado_reservas(
+            [valida.id, sin_datos.id, no_reserva.id], 'EN_CURSO'
+        )
+
+        self.assertEqual(actualizadas, 1)
+        valida.refresh_from_db()
+        self.assertEqual(valida.reserva_data['estado_reserva'], 'EN_CURSO')
+        self.assertIn('iniciado_en', valida.reserva_data)
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.mesa.estado, 'OCUPADA')
+
+    def test_transiciones_de_estado(self):
+        reserva = self._reserva()
+        for estado, campo, estado_mesa in (
+            ('CONFIRMADA', 'confirmado_en', 'LIBRE'),
+            ('EN_CURSO', 'iniciado_en', 'OCUPADA'),
+            ('COMPLETADA', 'completado_en', 'LIBRE'),
+        ):
+            with self.subTest(estado=estado):
+                self.assertTrue(ReservasManager.actualizar_estado_reserva(reserva.id, estado))
+                reserva.refresh_from_db()
+                self.mesa.refresh_from_db()
+                self.assertEqual(reserva.reserva_data['estado_reserva'], estado)
+                self.assertIn(campo, reserva.reserva_data)
+                self.assertEqual(self.mesa.estado, estado_mesa)
+
+    def test_mesa_especial_no_cambia_de_estado(self):
+        self.mesa = Mesa.objects.create(numero=50, capacidad=20, ubicacion='Reservas')
+        reserva = self._reserva()
+        ReservasManager.actualizar_estado_reserva(reserva.id, 'EN_CURSO')
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.mesa.estado, 'LIBRE')
+
+    def test_obtener_reservas_devuelve_lista_filtrada(self):
+        pendiente = self._reserva()
+        self._reserva({'estado_reserva': 'CONFIRMADA'})
+
+        reservas = ReservasManager.obtener_reservas({'estado': 'PENDIENTE'})
+
+        self.assertIsInstance(reservas, list)
+        self.assertEqual([r['orden_id'] for r in reservas], [pendiente.id])
+        self.assertEqual(reservas[0]['reserva_data']['numero_reserva'], f'R-{pendiente.id:06d}')
+
+
+class DatosRestauranteMixin:
+    """Mesero, mesa y un producto con stock para las pruebas de servicios."""
+
+    def setUp(self):
+        cache.clear()
+        self.mesero = Usuario.objects.create_user('mesero@test.com', 'Mesero', 'x')
+        self.mesa = Mesa.objects.create(numero=3, capacidad=4, ubicacion='Salón')
+        categoria = CategoriaProducto.objects.create(nombre='Platos')
+        self.producto = Producto.objects.create(
+            nombre='Bandeja', precio=Decimal('12'), cantidad=10, id_categoria=categoria
+        )
+
+    def _orden(self, cantidad=2, **campos):
+        orden = Orden.objects.create(mesero=self.mesero, mesa=self.mesa, estado='EN_PROCESO', **campos)
+        OrdenProducto.objects.create(
+            orden=orden, producto=self.producto, cantidad=cantidad, precio_unitario=self.producto.precio
+        )
+        return orden
+
+
+class VersionesTests(DatosRestauranteMixin, TestCase):
+    """Contadores de versión de cocina/stock y su alternativa con cache local."""
+
+    def test_notificar_incrementa_al_confirmar(self):
+        version = _leer_version(CLAVE_VERSION_COCINA)
+        with self.captureOnCommitCallbacks() as callbacks:
+            notificar_cambio_cocina()
+            self.assertEqual(_leer_version(CLAVE_VERSION_COCINA), version)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(_leer_version(CLAVE_VERSION_COCINA), version)
+
+    def test_senales_incrementan_versiones(self):
+        cocina = _leer_version(CLAVE_VERSION_COCINA)
+        stock = _leer_version(CLAVE_VERSION_STOCK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._orden()
+            self.producto.cantidad = 5
+            self.producto.save()
+        self.assertGreater(_leer_version(CLAVE_VERSION_COCINA), cocina)
+        self.assertGreater(_leer_version(CLAVE_VERSION_STOCK), stock)
+
+    def test_cache_local_detecta_escrituras_sin_senales(self):
+        # Con LocMemCache el hash sale de la BD: un UPDATE en lote también se ve
+        orden = self._orden()
+        cocina, stock = generar_hash_estado_cocina(), generar_hash_stock()
+        OrdenProducto.objects.filter(orden=orden).update(estado='LISTO')
+        Producto.objects.filter(pk=self.producto.pk).update(cantidad=3)
+        self.assertNotEqual(generar_hash_estado_cocina(), cocina)
+        self.assertNotEqual(generar_hash_stock(), stock)
+
+    def test_cache_compartida_usa_contador(self):
+        with mock.patch('core.utils.cache_compartida', return_value=True):
+            self.assertEqual(generar_hash_estado_cocina(), str(_leer_version(CLAVE_VERSION_COCINA)))
+            self.assertEqual(generar_hash_stock(), str(_leer_version(CLAVE_VERSION_STOCK)))
+
+
+class LongPollingTests(DatosRestauranteMixin, TestCase):
+    """Long polling asíncrono de cocina."""
+
+    async def test_hash_distinto_responde_cambios(self):
+        cliente = AsyncClient()
+        await cliente.aforce_login(self.mesero)
+        respuesta = await cliente.get('/api/longpolling/cocina/', {'hash': 'viejo'})
+        datos = respuesta.json()
+        self.assertTrue(datos['cambios'])
+        self.assertNotEqual(datos['hash'], 'viejo')
+
+    async def test_hash_igual_agota_el_tiempo(self):
+        hash_actual = await sync_to_async(generar_hash_estado_cocina)()
+        datos = await long_polling_cocina(hash_actual, timeout=0.1)
+        self.assertFalse(datos['cambios'])
+        self.assertEqual(datos['hash'], hash_actual)
+
+
+@skipUnless(SERVICIOS_DISPONIBLES, 'core.services no importa en este árbol')
+class MeseroServiceTests(DatosRestauranteMixin, TestCase):
+    """Creación de órdenes, descuento de stock y productos agregados."""
+
+    def test_crear_orden_descuenta_stock_y_ocupa_mesa(self):
+        stock = _leer_version(CLAVE_VERSION_STOCK)
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = MeseroService().crear_orden_completa(
+                self.mesero, self.mesa.id, [{'id': self.producto.id, 'cantidad': 3}]
+            )
+        self.assertTrue(resultado['success'], resultado.get('errores'))
+        self.producto.refresh_from_db()
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 7)
+        self.assertEqual(self.mesa.estado, 'OCUPADA')
+        # El descuento es un UPDATE sin post_save: la versión la sube notificar_cambio_stock
+        self.assertGreater(_leer_version(CLAVE_VERSION_STOCK), stock)
+
+    def test_stock_se_valida_acumulado(self):
+        resultado = MeseroService().crear_orden_completa(
+            self.mesero, self.mesa.id,
+            [{'id': self.producto.id, 'cantidad': 6}, {'id': self.producto.id, 'cantidad': 6}]
+        )
+        self.assertFalse(resultado['success'])
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 10)
+        self.assertFalse(Orden.objects.exists())
+
+    def test_agregar_productos_marca_tipo_agregado(self):
+        orden = self._orden()
+        resultado = MeseroService().agregar_productos_a_orden(
+            orden.id, [{'id': self.producto.id, 'cantidad': 1, 'observaciones': 'sin sal'}], self.mesero
+        )
+        self.assertTrue(resultado['success'], resultado.get('errores'))
+        agregado = orden.productos_ordenados.get(tipo_agregado='DESPUES')
+        self.assertEqual(agregado.observaciones, 'sin sal')
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 9)
+
+
+@skipUnless(SERVICIOS_DISPONIBLES, 'core.services no importa en este árbol')
+class CocinaServiceTests(DatosRestauranteMixin, TestCase):
+    """Cambios de cocina sobre productos y órdenes activas."""
+
+    def test_decrementar_devuelve_unidad_al_stock(self):
+        orden = self._orden(cantidad=3)
+        linea = orden.productos_ordenados.get()
+        resultado = CocinaService().decrementar_producto(linea.id, self.mesero)
+        self.assertTrue(resultado['success'], resultado.get('errores'))
+        self.assertEqual(resultado['nueva_cantidad'], 2)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 11)
+
+    def test_ultimo_producto_listo_completa_orden_y_factura(self):
+        orden = self._orden()
+        resultado = CocinaService().marcar_producto_listo(orden.productos_ordenados.get().id, self.mesero)
+        self.assertTrue(resultado['orden_completa'])
+        orden.refresh_from_db()
+        self.assertEqual(orden.estado, 'LISTA')
+        self.assertEqual(orden.factura.total, Decimal('24'))
+
+    def test_ordenes_activas_con_etag_igual_no_cambia_la_forma(self):
+        self._orden()
+        servicio = CocinaService()
+        primera = servicio.obtener_ordenes_activas_cocina()
+        self.assertEqual(primera['total_ordenes'], 1)
+        repetida = servicio.obtener_ordenes_activas_cocina(primera['etag'])
+        self.assertEqual(repetida, {
+            'success': True, 'cambios': False, 'etag': primera['etag'], 'ordenes': None, 'total_ordenes': None
+        })
+
+
+@skipUnless(SERVICIOS_DISPONIBLES, 'core.services no importa en este árbol')
+class CajeroServiceTests(DatosRestauranteMixin, TestCase):
+    """Pagos y reembolsos de facturas."""
+
+    def _factura(self):
+        orden = self._orden()
+        return Factura.objects.create(orden=orden, subtotal=Decimal('24'), total=Decimal('24'))
+
+    def test_pago_completo_libera_mesa(self):
+        factura = self._factura()
+        Mesa.objects.filter(pk=self.mesa.pk).update(estado='OCUPADA')
+        resultado = CajeroService().procesar_pago_factura(factura.id, 'EFECTIVO', 30)
+        self.assertTrue(resultado['success'], resultado.get('errores'))
+        self.assertEqual(resultado['pago']['cambio'], 6.0)
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.mesa.estado, 'LIBRE')
+
+    def test_pago_parcial_no_libera_mesa(self):
+        factura = self._factura()
+        Mesa.objects.filter(pk=self.mesa.pk).update(estado='OCUPADA')
+        resultado = CajeroService().procesar_pago_factura(factura.id, 'EFECTIVO', 10)
+        self.assertEqual(resultado['pago']['estado_pago'], 'PARCIAL')
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.mesa.estado, 'OCUPADA')
+
+    def test_reembolso_devuelve_stock(self):
+        factura = self._factura()
+        CajeroService().procesar_pago_factura(factura.id, 'EFECTIVO', 24)
+        resultado = CajeroService().procesar_reembolso(factura.id, 'Pedido equivocado')
+        self.assertTrue(resultado['success'], resultado.get('errores'))
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.cantidad, 12)
+
+
+class MigracionTipoAgregadoTests(TransactionTestCase):
+    """0008 traslada los marcadores AGREGADO_* a tipo_agregado y 0009 los quita de observaciones."""
+
+    antes = [('core', '0007_indice_orden_mesero_estado')]
+    despues = [('core', '0009_limpiar_marcadores_observaciones')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.antes)
+        apps = executor.loader.project_state(self.antes).apps
+        mesero = apps.get_model('core', 'Usuario').objects.create(email='m@test.com', nombre='M', password='x')
+        mesa = apps.get_model('core', 'Mesa').objects.create(numero=1, capacidad=2, ubicacion='Salón')
+        categoria = apps.get_model('core', 'CategoriaProducto').objects.create(nombre='Platos')
+        producto = apps.get_model('core', 'Producto').objects.create(
+            nombre='Bandeja', precio=Decimal('1'), id_categoria=categoria
+        )
+        orden = apps.get_model('core', 'Orden').objects.create(mesero=mesero, mesa=mesa)
+        OrdenProductoAntiguo = apps.get_model('core', 'OrdenProducto')
+        for observaciones in ('', 'sin sal', 'AGREGADO_DESPUES', 'AGREGADO_DESPUES|sin sal',
+                              'AGREGADO_POST_FACTURA|sin hielo'):
+            OrdenProductoAntiguo.objects.create(
+                orden=orden, producto=producto, cantidad=1, precio_unitario=Decimal('1'),
+                observaciones=observaciones
+            )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.despues)
+
+        filas = list(OrdenProducto.objects.order_by('id').values_list('tipo_agregado', 'observaciones'))
+        self.assertEqual(filas, [
+            ('ORIGINAL', ''), ('ORIGINAL', 'sin sal'), ('DESPUES', ''),
+            ('DESPUES', 'sin sal'), ('POST_FACTURA', 'sin hielo'),
+        ])
@@ -22,6 +22,13 @@ urlpatterns = [
     path('mesero/vista-cocina/', views.mesero_vista_cocina, name='mesero_vista_cocina'),
     path('mesero/mis-ordenes/', views.mesero_mis_ordenes, name='mesero_mis_ordenes'),
 
+    # === LONG POLLING Y EVENTOS (TIEMPO REAL) ===
+    # Primero entre las APIs: son las rutas que más se consultan
+    path('api/longpolling/cocina/', views.api_longpolling_cocina, name='api_longpolling_cocina'),
+    path('api/longpolling/meseros/', views.api_longpolling_meseros, name='api_longpolling_meseros'),
+    path('api/eventos/cocina/', views.api_eventos_cocina, name='api_eventos_cocina'),
+    path('api/eventos/meseros/', views.api_eventos_meseros, name='api_eventos_meseros'),
+
     # === API PRODUCTOS (CRUD BÁSICO) ===
     path('api/productos/', views.api_productos_list_create, name='api_productos_list_create'),
     path('api/productos/<int:pk>/', views.api_producto_detail, name='api_producto_detail'),
@@ -29,7 +36,6 @@ urlpatterns = [
     # === API ÓRDENES (CREAR Y GESTIONAR) ===
     path('api/orden/crear/', views.api_crear_orden_tiempo_real, name='api_crear_orden'),
     path('api/orden/<int:orden_id>/agregar-productos/', views.api_agregar_productos_orden, name='api_agregar_productos_orden'),
-    # ✅ UBICACIÓN CORRECTA - DENTRO DE LA SECCIÓN DE ÓRDENES
     path('api/orden/<int:orden_id>/agregar-productos-facturada/', views.api_agregar_productos_orden_facturada, name='api_agregar_productos_orden_facturada'),
     path('api/mesa/<int:mesa_id>/orden/', views.api_get_orden_por_mesa, name='api_get_orden_por_mesa'),
     path('api/orden/<int:orden_id>/servida/', views.api_marcar_orden_servida, name='api_marcar_orden_servida'),
@@ -43,29 +49,14 @@ urlpatterns = [
 
     # === API COCINA ===
     path('api/cocina/ordenes/', views.api_get_ordenes_cocina, name='api_get_ordenes_cocina'),
+    path('api/cocina/reservas/', views.api_get_reservas_cocina, name='api_get_reservas_cocina'),
     path('api/cocina/producto/<int:producto_orden_id>/listo/', views.api_marcar_producto_listo_tiempo_real, name='api_marcar_producto_listo'),
     path('api/cocina/producto/<int:producto_orden_id>/decrementar/', views.api_decrementar_producto_tiempo_real, name='api_decrementar_producto'),
     path('api/cocina/orden/<int:orden_id>/servida/', views.api_marcar_orden_servida, name='api_marcar_orden_servida'),
 
     # === API FACTURAS ===
     path('api/factura/orden/<int:orden_id>/', views.api_get_factura_por_orden, name='api_get_factura_por_orden'),
-    path('api/orden/<int:orden_id>/agregar-productos-facturada/', views.api_agregar_productos_orden_facturada, name='api_agregar_productos_orden_facturada'),
-    # === API FACTURAS ===
-    path('api/factura/orden/<int:orden_id>/', views.api_get_factura_por_orden, name='api_get_factura_por_orden'),
-    path('api/factura/<int:factura_id>/pagar/', views.api_marcar_factura_pagada, name='api_marcar_factura_pagada'),  # ✅ NUEVA LÍNEA
-        
-    
-    # En core/urls.py debe existir:
-    path('api/orden/<int:orden_id>/agregar-productos/', views.api_agregar_productos_orden, name='api_agregar_productos_orden'),
-
-    # === LONG POLLING (TIEMPO REAL) ===
-    path('api/longpolling/cocina/', views.api_longpolling_cocina, name='api_longpolling_cocina'),
-    path('api/longpolling/meseros/', views.api_longpolling_meseros, name='api_longpolling_meseros'),
-
-
-    # ✅ AGREGADA:
-    path('api/cocina/reservas/', views.api_get_reservas_cocina, name='api_get_reservas_cocina'),
-
+    path('api/factura/<int:factura_id>/pagar/', views.api_marcar_factura_pagada, name='api_marcar_factura_pagada'),
 
     # === SISTEMA Y DEBUG ===
     path('api/sistema/estadisticas/', views.api_estadisticas_sistema, name='api_estadisticas_sistema'),
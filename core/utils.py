@@ -2,71 +2,134 @@
 
 import json
 import time
+import asyncio
 import hashlib
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+from django.conf import settings
+from django.db.models import DecimalField, F, Prefetch, Sum
 from .models import Orden, OrdenProducto, Producto
 
-def generar_hash_estado_cocina():
+CLAVE_VERSION_COCINA = 'cocina_version'
+CLAVE_VERSION_STOCK = 'stock_version'
+
+
+def _semilla_version():
+    """Valor inicial de un contador: basado en el reloj para no repetir versiones si la cache se reinicia"""
+    return int(time.time() * 1000)
+
+def _leer_version(clave):
+    """Lee un contador de versión de la cache, inicializándolo si no existe"""
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, _semilla_version(), None)
+        version = cache.get(clave)
+    return version
+
+def _incrementar_version(clave):
+    """Incrementa de forma atómica un contador de versión de la cache"""
+    cache.add(clave, _semilla_version(), None)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        # La clave fue expulsada entre add e incr
+        cache.set(clave, _semilla_version(), None)
+
+def cache_compartida():
     """
-    Genera un hash del estado actual de la cocina para detectar cambios
+    Indica si la cache por defecto es compartida entre procesos (Redis).
+    LocMemCache es por proceso: sus contadores e invalidaciones no llegan a los demás workers.
     """
-    ordenes = Orden.objects.filter(estado__in=['EN_PROCESO', 'NUEVA']).order_by('id')
+    return not settings.CACHES['default']['BACKEND'].endswith('LocMemCache')
+
+def _hash_estado_cocina_bd():
+    """Hash del estado de la cocina derivado de la BD (una sola consulta)"""
+    filas = Orden.objects.filter(estado__in=['EN_PROCESO', 'NUEVA']).order_by(
+        'id', 'productos_ordenados__id'
+    ).values_list(
+        'id', 'estado', 'productos_ordenados__id',
+        'productos_ordenados__estado', 'productos_ordenados__cantidad'
+    )
     
     estado_datos = []
-    for orden in ordenes:
-        productos = []
-        for po in orden.productos_ordenados.all():
-            productos.append(f"{po.id}:{po.estado}:{po.cantidad}")
-        
-        estado_datos.append(f"{orden.id}:{orden.estado}:{':'.join(productos)}")
+    for (orden_id, orden_estado), grupo in groupby(filas, key=itemgetter(0, 1)):
+        productos = [f"{po_id}:{po_estado}:{cantidad}" for _, _, po_id, po_estado, cantidad in grupo if po_id is not None]
+        estado_datos.append(f"{orden_id}:{orden_estado}:{':'.join(productos)}")
     
-    estado_string = '|'.join(estado_datos)
-    return hashlib.md5(estado_string.encode()).hexdigest()
+    return hashlib.md5('|'.join(estado_datos).encode()).hexdigest()
+
+def _hash_stock_bd():
+    """Hash del stock derivado de la BD, sin instanciar modelos"""
+    filas = Producto.objects.filter(is_active=True).order_by('id').values_list('id', 'cantidad')
+    return hashlib.md5('|'.join(f"{id_}:{cantidad}" for id_, cantidad in filas).encode()).hexdigest()
+
+def generar_hash_estado_cocina():
+    """
+    Versión actual del estado de la cocina para detectar cambios.
+    Con cache compartida es el contador que incrementa notificar_cambio_cocina
+    (y las señales de Orden/OrdenProducto); con cache local se deriva de la BD
+    para que todos los workers entreguen el mismo valor.
+    """
+    if cache_compartida():
+        return str(_leer_version(CLAVE_VERSION_COCINA))
+    return _hash_estado_cocina_bd()
 
 def generar_hash_stock():
     """
-    Genera un hash del stock actual para detectar cambios
+    Versión actual del stock para detectar cambios (mismo criterio que la de cocina).
     """
-    productos = Producto.objects.filter(is_active=True).order_by('id')
-    stock_string = '|'.join([f"{p.id}:{p.cantidad}" for p in productos])
-    return hashlib.md5(stock_string.encode()).hexdigest()
+    if cache_compartida():
+        return str(_leer_version(CLAVE_VERSION_STOCK))
+    return _hash_stock_bd()
 
 
 # ✅ ACTUALIZAR: obtener_datos_completos_orden EXISTENTE
+def precargar_productos_orden(ordenes):
+    """
+    Precarga mesa, mesero y productos (solo las columnas que usa
+    obtener_datos_completos_orden) de un queryset de órdenes
+    """
+    return ordenes.select_related('mesa', 'mesero').prefetch_related(
+        Prefetch('productos_ordenados', queryset=OrdenProducto.objects.select_related('producto').only(
+            'id', 'orden_id', 'estado', 'cantidad', 'precio_unitario', 'observaciones',
+            'tipo_agregado', 'listo_en', 'producto__nombre'
+        ))
+    )
+
+
+def obtener_orden_con_productos(orden_id):
+    """Obtiene una orden con mesa, mesero y productos precargados para obtener_datos_completos_orden"""
+    return precargar_productos_orden(Orden.objects.all()).get(id=orden_id)
+
+
 def obtener_datos_completos_orden(orden):
     """Obtiene todos los datos de una orden para enviar al frontend"""
     try:
         productos_data = []
+        total_orden = 0
         for po in orden.productos_ordenados.all():
-            # Detectar si es agregado después
-            agregado_despues = po.observaciones and 'AGREGADO_DESPUES' in po.observaciones
-            
-            # Limpiar observaciones para mostrar
-            obs_limpia = ''
-            if po.observaciones:
-                if 'AGREGADO_DESPUES' in po.observaciones:
-                    parts = po.observaciones.split('|')
-                    if len(parts) > 1:
-                        obs_limpia = parts[1]  # Obtener la observación real
-                else:
-                    obs_limpia = po.observaciones
+            total_orden += po.cantidad * po.precio_unitario
             
             productos_data.append({
                 'id': po.id,
                 'nombre': po.producto.nombre,
                 'cantidad': po.cantidad,
                 'precio_unitario': float(po.precio_unitario),
-                'observaciones': obs_limpia,
+                'observaciones': po.observaciones or '',
                 'estado': po.estado,
-                'agregado_despues': agregado_despues,
+                'tipo_agregado': po.tipo_agregado,
+                'agregado_despues': po.tipo_agregado == 'DESPUES',
                 'listo_en': po.listo_en.isoformat() if po.listo_en else None
             })
         
-        # ✅ USAR FUNCIÓN UTILITARIA
-        total_orden = calcular_total_orden(orden)
-        
         # Obtener nombre del mesero
         mesero_nombre = orden.mesero.nombre if hasattr(orden.mesero, 'nombre') else orden.mesero.username
         
@@ -108,49 +171,68 @@ def obtener_todas_ordenes_cocina():
     """
     Obtiene todas las órdenes para la cocina con datos completos
     """
-    ordenes = Orden.objects.filter(estado__in=['EN_PROCESO', 'NUEVA']).order_by('creado_en')
-    return [obtener_datos_completos_orden(orden) for orden in ordenes]
+    ordenes = precargar_productos_orden(
+        Orden.objects.filter(estado__in=['EN_PROCESO', 'NUEVA'])
+    ).order_by('creado_en')
+    # Por bloques de 50 (con su prefetch): en memoria solo un bloque de objetos del ORM a la vez
+    return [obtener_datos_completos_orden(orden) for orden in ordenes.iterator(chunk_size=50)]
 
 def obtener_stock_productos():
     """
     Obtiene el stock actual de todos los productos activos
     """
-    productos = Producto.objects.filter(is_active=True, is_available=True)
+    # Solo las columnas necesarias, con la categoría en el mismo JOIN
+    productos = Producto.objects.filter(is_active=True, is_available=True).values(
+        'id', 'nombre', 'cantidad', 'precio', 'id_categoria__nombre'
+    )
     return {
-        str(producto.id): {
-            'id': producto.id,
-            'nombre': producto.nombre,
-            'stock': producto.cantidad,
-            'precio': float(producto.precio),
-            'categoria': producto.id_categoria.nombre if producto.id_categoria else ''
+        str(producto['id']): {
+            'id': producto['id'],
+            'nombre': producto['nombre'],
+            'stock': producto['cantidad'],
+            'precio': float(producto['precio']),
+            'categoria': producto['id_categoria__nombre'] or ''
         } for producto in productos
     }
 
-def long_polling_cocina(hash_anterior=None, timeout=30):
+def _datos_cambio_cocina(hash_actual):
     """
-    Long polling para cocina usando hash del estado
+    Arma la respuesta del long polling de cocina cuando cambió la versión.
+    Las órdenes se guardan por versión: todos los clientes que ven la misma
+    versión comparten una sola reconstrucción desde la BD.
+    """
+    clave_payload = f'cocina_payload:{hash_actual}'
+    ordenes = cache.get(clave_payload)
+    if ordenes is None:
+        ordenes = obtener_todas_ordenes_cocina()
+        cache.set(clave_payload, ordenes, 60)
+        
+        # Guardar en cache para debug
+        cache.set('ultimo_hash_cocina', hash_actual, 300)  # 5 minutos
+        cache.set('ultima_actualizacion_cocina', timezone.now().isoformat(), 300)
+    
+    return {
+        'cambios': True,
+        'hash': hash_actual,
+        'ordenes': ordenes,
+        'timestamp': timezone.now().isoformat()
+    }
+
+async def long_polling_cocina(hash_anterior=None, timeout=30):
+    """
+    Long polling para cocina usando hash del estado.
+    Es asíncrono: la espera no ocupa un hilo del servidor.
     """
     start_time = time.time()
     
     while time.time() - start_time < timeout:
-        hash_actual = generar_hash_estado_cocina()
+        hash_actual = await sync_to_async(generar_hash_estado_cocina)()
         
         # Si el hash cambió o es la primera vez
         if hash_actual != hash_anterior:
-            ordenes = obtener_todas_ordenes_cocina()
-            
-            # Guardar en cache para debug
-            cache.set('ultimo_hash_cocina', hash_actual, 300)  # 5 minutos
-            cache.set('ultima_actualizacion_cocina', timezone.now().isoformat(), 300)
-            
-            return {
-                'cambios': True,
-                'hash': hash_actual,
-                'ordenes': ordenes,
-                'timestamp': timezone.now().isoformat()
-            }
+            return await sync_to_async(_datos_cambio_cocina)(hash_actual)
         
-        time.sleep(0.5)  # Verificar cada 500ms
+        await asyncio.sleep(0.5)  # Verificar cada 500ms
     
     # Timeout - no hubo cambios
     return {
@@ -159,37 +241,47 @@ def long_polling_cocina(hash_anterior=None, timeout=30):
         'timestamp': timezone.now().isoformat()
     }
 
-def long_polling_meseros(hash_stock_anterior=None, timeout=30):
+def _datos_cambio_stock(hash_stock_actual):
+    """Arma la respuesta del long polling de meseros cuando cambió la versión del stock (compartida por versión)"""
+    clave_payload = f'stock_payload:{hash_stock_actual}'
+    payload = cache.get(clave_payload)
+    if payload is None:
+        stock_actual = obtener_stock_productos()
+        
+        # También verificar órdenes recientes para notificaciones
+        ordenes_recientes = precargar_productos_orden(Orden.objects.filter(
+            creado_en__gte=timezone.now() - timedelta(minutes=5)
+        )).order_by('-creado_en')[:5]
+        
+        ordenes_data = [obtener_datos_completos_orden(orden) for orden in ordenes_recientes]
+        payload = (stock_actual, ordenes_data)
+        cache.set(clave_payload, payload, 60)
+        
+        cache.set('ultimo_hash_stock', hash_stock_actual, 300)
+        cache.set('ultima_actualizacion_stock', timezone.now().isoformat(), 300)
+    stock_actual, ordenes_data = payload
+    
+    return {
+        'cambios': True,
+        'hash_stock': hash_stock_actual,
+        'stock_productos': stock_actual,
+        'ordenes_recientes': ordenes_data,
+        'timestamp': timezone.now().isoformat()
+    }
+
+async def long_polling_meseros(hash_stock_anterior=None, timeout=30):
     """
-    Long polling para meseros usando hash del stock
+    Long polling para meseros usando hash del stock (asíncrono, como el de cocina)
     """
     start_time = time.time()
     
     while time.time() - start_time < timeout:
-        hash_stock_actual = generar_hash_stock()
+        hash_stock_actual = await sync_to_async(generar_hash_stock)()
         
         if hash_stock_actual != hash_stock_anterior:
-            stock_actual = obtener_stock_productos()
-            
-            # También verificar órdenes recientes para notificaciones
-            ordenes_recientes = Orden.objects.filter(
-                creado_en__gte=timezone.now() - timedelta(minutes=5)
-            ).order_by('-creado_en')[:5]
-            
-            ordenes_data = [obtener_datos_completos_orden(orden) for orden in ordenes_recientes]
-            
-            cache.set('ultimo_hash_stock', hash_stock_actual, 300)
-            cache.set('ultima_actualizacion_stock', timezone.now().isoformat(), 300)
-            
-            return {
-                'cambios': True,
-                'hash_stock': hash_stock_actual,
-                'stock_productos': stock_actual,
-                'ordenes_recientes': ordenes_data,
-                'timestamp': timezone.now().isoformat()
-            }
+            return await sync_to_async(_datos_cambio_stock)(hash_stock_actual)
         
-        time.sleep(1)  # Verificar cada segundo para stock
+        await asyncio.sleep(1)  # Verificar cada segundo para stock
     
     return {
         'cambios': False,
@@ -197,20 +289,81 @@ def long_polling_meseros(hash_stock_anterior=None, timeout=30):
         'timestamp': timezone.now().isoformat()
     }
 
+# === EVENTOS SSE ===
+
+def sse_disponible(request):
+    """
+    Los eventos SSE solo se ofrecen bajo ASGI y con cache compartida:
+    - con WSGI Django acumula el flujo asíncrono completo antes de enviarlo;
+    - cada conexión revisa la versión cada 0.5-1 s, lo que solo es barato cuando
+      es un GET de cache; con cache local sería una consulta a la BD por tick.
+    """
+    return isinstance(request, ASGIRequest) and cache_compartida()
+
+def _evento_sse(nombre, hash_actual, datos):
+    """Formatea un evento Server-Sent Events; el id permite reanudar con Last-Event-ID"""
+    return f"id: {hash_actual}\nevent: {nombre}\ndata: {json.dumps(datos, cls=DjangoJSONEncoder)}\n\n"
+
+async def _cambios_de_version(leer_version, hash_anterior, intervalo, duracion):
+    """
+    Genera la nueva versión cada vez que cambia, y None como latido
+    cada 15 s para que los proxies no cierren la conexión inactiva
+    """
+    inicio = ultimo_envio = time.time()
+    
+    while time.time() - inicio < duracion:
+        hash_actual = await sync_to_async(leer_version)()
+        
+        if hash_actual != hash_anterior:
+            hash_anterior = hash_actual
+            ultimo_envio = time.time()
+            yield hash_actual
+        elif time.time() - ultimo_envio >= 15:
+            ultimo_envio = time.time()
+            yield None
+        
+        await asyncio.sleep(intervalo)
+
+async def eventos_cocina(hash_anterior=None, duracion=300):
+    """
+    Flujo SSE para cocina: envía el mismo contenido que long_polling_cocina
+    solo cuando cambia la versión. Se cierra tras `duracion` segundos y el
+    navegador reconecta solo (EventSource).
+    """
+    async for hash_actual in _cambios_de_version(generar_hash_estado_cocina, hash_anterior, 0.5, duracion):
+        if hash_actual is None:
+            yield ': ping\n\n'
+            continue
+        datos = await sync_to_async(_datos_cambio_cocina)(hash_actual)
+        yield _evento_sse('cocina', hash_actual, datos)
+
+async def eventos_meseros(hash_stock_anterior=None, duracion=300, datos_extra=None):
+    """
+    Flujo SSE para meseros con el contenido de long_polling_meseros.
+    datos_extra: función síncrona opcional cuyo dict se agrega a cada evento
+    """
+    async for hash_actual in _cambios_de_version(generar_hash_stock, hash_stock_anterior, 1, duracion):
+        if hash_actual is None:
+            yield ': ping\n\n'
+            continue
+        datos = await sync_to_async(_datos_cambio_stock)(hash_actual)
+        if datos_extra:
+            datos.update(await sync_to_async(datos_extra)())
+        yield _evento_sse('meseros', hash_actual, datos)
+
 def notificar_cambio_cocina():
     """
     Función para forzar notificación a la cocina
-    Incrementa un contador en cache para romper el hash
+    Incrementa la versión de cocina al confirmar la transacción en curso,
+    para que el long polling no relea la BD antes de ver el cambio
     """
-    contador = cache.get('notificacion_cocina', 0)
-    cache.set('notificacion_cocina', contador + 1, 300)
+    transaction.on_commit(lambda: _incrementar_version(CLAVE_VERSION_COCINA))
 
 def notificar_cambio_stock():
     """
     Función para forzar notificación a meseros
     """
-    contador = cache.get('notificacion_stock', 0)
-    cache.set('notificacion_stock', contador + 1, 300)
+    transaction.on_commit(lambda: _incrementar_version(CLAVE_VERSION_STOCK))
 
 def obtener_estadisticas_sistema():
     """
@@ -235,16 +388,29 @@ def calcular_total_orden(orden):
     Reemplaza el método calcular_total() que no existe en el modelo
     """
     try:
-        total = sum(
-            item.cantidad * item.precio_unitario 
-            for item in orden.productos_ordenados.all()
-        )
-        return total
+        # Con los productos ya precargados se suma en Python; si no, un SUM en la BD
+        if 'productos_ordenados' in getattr(orden, '_prefetched_objects_cache', {}):
+            return sum(
+                item.cantidad * item.precio_unitario 
+                for item in orden.productos_ordenados.all()
+            )
+        return calcular_total_orden_sql(orden.id)
     except Exception as e:
         print(f"Error calculando total de orden {orden.id}: {str(e)}")
         return 0
 
 
+def calcular_total_orden_sql(orden_id):
+    """
+    Calcula el total de una orden con un SUM en la base de datos,
+    sin traer las líneas de la orden a Python.
+    """
+    total = OrdenProducto.objects.filter(orden_id=orden_id).aggregate(
+        total=Sum(F('cantidad') * F('precio_unitario'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    )['total']
+    return total if total is not None else Decimal('0')
+
+
 
 def calcular_tiempo_transcurrido(fecha_creacion):
     """Calcula el tiempo transcurrido desde la creación - VERSIÓN CORREGIDA"""
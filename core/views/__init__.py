@@ -54,6 +54,8 @@ from .api_views import (
     # Long polling
     api_longpolling_cocina,
     api_longpolling_meseros,
+    api_eventos_cocina,
+    api_eventos_meseros,
     
     # Sistema y debug
     api_estadisticas_sistema,
@@ -117,6 +119,8 @@ __all__ = [
     # Long polling
     'api_longpolling_cocina',
     'api_longpolling_meseros',
+    'api_eventos_cocina',
+    'api_eventos_meseros',
     
     # Sistema
     'api_estadisticas_sistema',
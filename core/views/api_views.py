@@ -7,9 +7,10 @@ Contiene todas las APIs para órdenes, mesero, cocina, facturas y long polling.
 import json
 import time
 import re
+from asgiref.sync import sync_to_async
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods, require_POST
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_exempt
@@ -21,9 +22,10 @@ from ..decorators import debounce_request, critical_operation, form_debounce
 from ..models import Producto, CategoriaProducto, Mesa, Orden, OrdenProducto, Factura
 from ..utils import (
     long_polling_cocina, long_polling_meseros, obtener_todas_ordenes_cocina,
+    eventos_cocina, eventos_meseros, sse_disponible,
     obtener_stock_productos, notificar_cambio_cocina, notificar_cambio_stock,
     obtener_estadisticas_sistema, obtener_datos_completos_orden,
-    calcular_total_orden,
+    precargar_productos_orden, calcular_total_orden,
 )
 
 
@@ -136,8 +138,7 @@ def extraer_info_cliente_reserva(observaciones):
 def limpiar_debounces_usuario(user_id):
     """Función utilitaria para limpiar debounces de un usuario específico"""
     try:
-        from django.core.cache import cache
-        from ..decorators import DEBOUNCE_CONFIG
+        from ..decorators import generate_debounce_key, debounce_cache
         
         # Limpiar debounces conocidos del usuario
         acciones_comunes = [
@@ -151,8 +152,8 @@ def limpiar_debounces_usuario(user_id):
         ]
         
         for accion in acciones_comunes:
-            debounce_key = f"{DEBOUNCE_CONFIG['CACHE_PREFIX']}{user_id}:{accion}"
-            cache.delete(debounce_key)
+            debounce_key = generate_debounce_key(user_id, accion)
+            debounce_cache.delete(debounce_key)
             
         print(f"🧹 Debounces limpiados para usuario {user_id}")
         return True
@@ -335,15 +336,15 @@ def api_agregar_productos_orden(request, orden_id):
         
         print(f"✅ Validación completada para {len(productos_validados)} productos")
         
-        # 🔧 DETERMINAR MARCADOR SEGÚN TIPO DE ORDEN
+        # 🔧 DETERMINAR TIPO DE REGISTRO SEGÚN TIPO DE ORDEN
         if tiene_factura_pendiente or es_orden_facturada:
-            marcador_obs = "AGREGADO_POST_FACTURA"
+            tipo_registro = 'POST_FACTURA'
             tipo_agregado = "post-factura"
         else:
-            marcador_obs = "AGREGADO_DESPUES"
+            tipo_registro = 'DESPUES'
             tipo_agregado = "después de creación"
         
-        print(f"🏷️ Productos serán marcados como: {marcador_obs}")
+        print(f"🏷️ Productos serán marcados como: {tipo_registro}")
         
         # 🔧 PROCESAR PRODUCTOS Y ACTUALIZAR STOCK
         productos_agregados = []
@@ -355,19 +356,14 @@ def api_agregar_productos_orden(request, orden_id):
                 cantidad = item_validado['cantidad']
                 observaciones_usuario = item_validado['observaciones']
                 
-                # Preparar observaciones finales
-                if observaciones_usuario:
-                    obs_final = f"{marcador_obs}|{observaciones_usuario}"
-                else:
-                    obs_final = marcador_obs
-                
                 # Crear OrdenProducto
                 nuevo_producto_orden = OrdenProducto.objects.create(
                     orden=orden,
                     producto=producto,
                     cantidad=cantidad,
                     precio_unitario=producto.precio,
-                    observaciones=obs_final,
+                    observaciones=observaciones_usuario,
+                    tipo_agregado=tipo_registro,
                     estado='PENDIENTE'
                 )
                 
@@ -522,19 +518,13 @@ def api_agregar_productos_orden_facturada(request, orden_id):
         for item in productos_nuevos:
             producto = Producto.objects.get(id=item['id'])
             
-            # Marcar como agregado post-factura
-            obs_producto = item.get('observaciones', '')
-            if obs_producto:
-                obs_final = f"AGREGADO_POST_FACTURA|{obs_producto}"
-            else:
-                obs_final = "AGREGADO_POST_FACTURA"
-            
             nuevo_producto_orden = OrdenProducto.objects.create(
                 orden=orden,
                 producto=producto,
                 cantidad=item['cantidad'],
                 precio_unitario=producto.precio,
-                observaciones=obs_final,
+                observaciones=item.get('observaciones', ''),
+                tipo_agregado='POST_FACTURA',
                 estado='PENDIENTE'
             )
             
@@ -606,8 +596,7 @@ def api_get_orden_por_mesa(request, mesa_id):
         productos_agregados = []
         
         for producto in orden_data['productos']:
-            op = OrdenProducto.objects.get(id=producto['id'])
-            if op.observaciones and ('AGREGADO_DESPUES' in op.observaciones or 'AGREGADO_POST_FACTURA' in op.observaciones):
+            if producto['tipo_agregado'] != 'ORIGINAL':
                 producto['agregado_despues'] = True
                 productos_agregados.append(producto)
             else:
@@ -673,23 +662,22 @@ def api_get_ordenes_mesero(request):
     """API para obtener órdenes que debe monitorear el mesero"""
     try:
         # Órdenes del mesero que están activas
-        ordenes = Orden.objects.filter(
+        ordenes = precargar_productos_orden(Orden.objects.filter(
             mesero=request.user,
             estado__in=['EN_PROCESO', 'LISTA']
-        ).order_by('-creado_en')
+        )).order_by('-creado_en')
         
         ordenes_data = []
         for orden in ordenes:
             orden_data = obtener_datos_completos_orden(orden)
             
-            # Contar productos por estado
-            productos_listos = orden.productos_ordenados.filter(estado='LISTO').count()
-            productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
+            # Contar productos por estado sobre los productos ya precargados
+            productos = orden_data['productos']
+            productos_listos = sum(1 for p in productos if p['estado'] == 'LISTO')
+            productos_pendientes = sum(1 for p in productos if p['estado'] == 'PENDIENTE')
             
             # Verificar si hay productos agregados después
-            productos_agregados = orden.productos_ordenados.filter(
-                observaciones__icontains='AGREGADO_DESPUES'
-            ).count()
+            productos_agregados = sum(1 for p in productos if p['tipo_agregado'] == 'DESPUES')
             
             # Agregar información adicional para meseros
             orden_data.update({
@@ -745,7 +733,7 @@ def api_get_todas_ordenes_mesero(request):
             fecha_limite = timezone.now() - timedelta(days=7)
             ordenes_query = ordenes_query.filter(creado_en__gte=fecha_limite)
             
-        ordenes = ordenes_query.order_by('-creado_en')[:50]
+        ordenes = precargar_productos_orden(ordenes_query).order_by('-creado_en')[:50]
         
         ordenes_data = []
         for orden in ordenes:
@@ -762,40 +750,25 @@ def api_get_todas_ordenes_mesero(request):
             elif es_reserva:
                 cliente_info = extraer_info_cliente_reserva(orden.observaciones)
             
-            # Contar productos por estado
-            productos_listos = orden.productos_ordenados.filter(estado='LISTO').count()
-            productos_pendientes = orden.productos_ordenados.filter(estado='PENDIENTE').count()
-            productos_agregados = orden.productos_ordenados.filter(
-                observaciones__icontains='AGREGADO_DESPUES'
-            ).count()
-            productos_post_factura = orden.productos_ordenados.filter(
-                observaciones__icontains='AGREGADO_POST_FACTURA'
-            ).count()
+            # Contar productos por estado sobre los productos ya precargados
+            productos = orden_data['productos']
+            productos_listos = sum(1 for p in productos if p['estado'] == 'LISTO')
+            productos_pendientes = sum(1 for p in productos if p['estado'] == 'PENDIENTE')
+            productos_agregados = sum(1 for p in productos if p['tipo_agregado'] == 'DESPUES')
+            productos_post_factura = sum(1 for p in productos if p['tipo_agregado'] == 'POST_FACTURA')
             
             # Marcar productos con información especial
             productos_con_info = []
             for po in orden.productos_ordenados.all():
-                agregado_despues = po.observaciones and 'AGREGADO_DESPUES' in po.observaciones
-                agregado_post_factura = po.observaciones and 'AGREGADO_POST_FACTURA' in po.observaciones
-                
-                # Limpiar observaciones para mostrar
-                obs_limpia = ''
-                if po.observaciones:
-                    if 'AGREGADO_POST_FACTURA' in po.observaciones:
-                        parts = po.observaciones.split('|')
-                        obs_limpia = parts[1] if len(parts) > 1 else ''
-                    elif 'AGREGADO_DESPUES' in po.observaciones:
-                        parts = po.observaciones.split('|')
-                        obs_limpia = parts[1] if len(parts) > 1 else ''
-                    else:
-                        obs_limpia = po.observaciones
+                agregado_despues = po.tipo_agregado == 'DESPUES'
+                agregado_post_factura = po.tipo_agregado == 'POST_FACTURA'
                 
                 productos_con_info.append({
                     'id': po.id,
                     'nombre': po.producto.nombre,
                     'cantidad': po.cantidad,
                     'precio_unitario': float(po.precio_unitario),
-                    'observaciones': obs_limpia,
+                    'observaciones': po.observaciones or '',
                     'estado': po.estado,
                     'listo_en': po.listo_en.isoformat() if po.listo_en else None,
                     'agregado_despues': agregado_despues,
@@ -869,17 +842,15 @@ def api_marcar_orden_lista_manual(request, orden_id):
         if orden.estado == 'SERVIDA':
             return JsonResponse({'error': 'No se puede modificar una orden ya servida'}, status=400)
         
-        # Marcar todos los productos como listos
-        productos_actualizados = 0
-        for producto_orden in orden.productos_ordenados.filter(estado='PENDIENTE'):
-            producto_orden.estado = 'LISTO'
-            producto_orden.listo_en = timezone.now()
-            producto_orden.save()
-            productos_actualizados += 1
+        # Marcar todos los productos como listos (un solo UPDATE)
+        ahora = timezone.now()
+        productos_actualizados = orden.productos_ordenados.filter(
+            estado='PENDIENTE'
+        ).update(estado='LISTO', listo_en=ahora)
         
         # Marcar orden como lista
         orden.estado = 'LISTA'
-        orden.listo_en = timezone.now()
+        orden.listo_en = ahora
         orden.save()
         
         # Notificar cambios
@@ -1227,24 +1198,14 @@ def api_get_ordenes_cocina(request):
                     if po.estado == 'PENDIENTE':
                         todos_listos = False
                     
-                    # Detectar productos agregados después usando observaciones
-                    agregado_despues = po.observaciones and 'AGREGADO_DESPUES' in po.observaciones
-                    
-                    # Limpiar observaciones para mostrar
-                    obs_limpia = ''
-                    if po.observaciones:
-                        if 'AGREGADO_DESPUES' in po.observaciones:
-                            parts = po.observaciones.split('|')
-                            if len(parts) > 1:
-                                obs_limpia = parts[1]  # Obtener la observación real después del marcador
-                        else:
-                            obs_limpia = po.observaciones
+                    # Detectar productos agregados después
+                    agregado_despues = po.tipo_agregado == 'DESPUES'
                     
                     lista_productos.append({
                         'id': po.id,
                         'nombre': po.producto.nombre,
                         'cantidad': po.cantidad,
-                        'observaciones': obs_limpia,
+                        'observaciones': po.observaciones or '',
                         'estado': po.estado,
                         'agregado_despues': agregado_despues,
                         'clase_css': 'nuevo-agregado' if agregado_despues else ('listo' if po.estado == 'LISTO' else '')
@@ -1299,21 +1260,13 @@ def api_get_reservas_cocina(request):
                     if po.estado == 'PENDIENTE':
                         todos_listos = False
                     
-                    agregado_despues = po.observaciones and 'AGREGADO_DESPUES' in po.observaciones
-                    
-                    obs_limpia = ''
-                    if po.observaciones:
-                        if 'AGREGADO_DESPUES' in po.observaciones:
-                            parts = po.observaciones.split('|')
-                            obs_limpia = parts[1] if len(parts) > 1 else ''
-                        else:
-                            obs_limpia = po.observaciones
+                    agregado_despues = po.tipo_agregado == 'DESPUES'
                     
                     lista_productos.append({
                         'id': po.id,
                         'nombre': po.producto.nombre,
                         'cantidad': po.cantidad,
-                        'observaciones': obs_limpia,
+                        'observaciones': po.observaciones or '',
                         'estado': po.estado,
                         'agregado_despues': agregado_despues
                     })
@@ -1357,8 +1310,9 @@ def api_marcar_producto_listo_tiempo_real(request, producto_orden_id):
         producto_nombre = producto_orden.producto.nombre
         
         # Actualizar estado
+        ahora = timezone.now()
         producto_orden.estado = 'LISTO'
-        producto_orden.listo_en = timezone.now()
+        producto_orden.listo_en = ahora
         producto_orden.save()
 
         # Verificar si la orden está completa
@@ -1367,7 +1321,7 @@ def api_marcar_producto_listo_tiempo_real(request, producto_orden_id):
         
         if productos_pendientes == 0:
             orden.estado = 'LISTA'
-            orden.listo_en = timezone.now()
+            orden.listo_en = ahora
             orden.save()
             orden_completa = True
         
@@ -1488,21 +1442,12 @@ def api_get_factura_por_orden(request, orden_id):
         for producto_orden in orden.productos_ordenados.all():
             subtotal = producto_orden.cantidad * producto_orden.precio_unitario
             
-            # Limpiar observaciones
-            obs_limpia = ''
-            if producto_orden.observaciones:
-                if 'AGREGADO_DESPUES' in producto_orden.observaciones:
-                    parts = producto_orden.observaciones.split('|')
-                    obs_limpia = parts[1] if len(parts) > 1 else ''
-                else:
-                    obs_limpia = producto_orden.observaciones
-            
             productos_factura.append({
                 'nombre': producto_orden.producto.nombre,
                 'cantidad': producto_orden.cantidad,
                 'precio_unitario': float(producto_orden.precio_unitario),
                 'subtotal': float(subtotal),
-                'observaciones': obs_limpia
+                'observaciones': producto_orden.observaciones or ''
             })
         
         factura_data = {
@@ -1549,12 +1494,12 @@ def api_get_factura_por_orden(request, orden_id):
 
 @never_cache
 @login_required
-def api_longpolling_cocina(request):
-    """Long polling para el dashboard de cocina"""
+async def api_longpolling_cocina(request):
+    """Long polling para el dashboard de cocina (vista asíncrona: no bloquea un hilo mientras espera)"""
     hash_anterior = request.GET.get('hash', None)
     
     try:
-        resultado = long_polling_cocina(hash_anterior, timeout=25)
+        resultado = await long_polling_cocina(hash_anterior, timeout=25)
         return JsonResponse(resultado)
     except Exception as e:
         return JsonResponse({
@@ -1564,35 +1509,39 @@ def api_longpolling_cocina(request):
         }, status=500)
 
 
+def _notificaciones_mesero(mesero):
+    """Órdenes activas del mesero con productos listos, para el long polling"""
+    ordenes_mesero = Orden.objects.filter(
+        mesero=mesero,
+        estado__in=['EN_PROCESO', 'LISTA']
+    )
+    
+    notificaciones = []
+    for orden in ordenes_mesero:
+        productos_listos = orden.productos_ordenados.filter(estado='LISTO')
+        if productos_listos.exists():
+            notificaciones.append({
+                'orden_id': orden.id,
+                'mesa': orden.mesa.numero,
+                'productos_listos': [p.producto.nombre for p in productos_listos],
+                'todos_listos': orden.estado == 'LISTA'
+            })
+    return notificaciones
+
+
 @never_cache
 @login_required  
-def api_longpolling_meseros(request):
+async def api_longpolling_meseros(request):
     """Long polling para meseros - detecta cuando hay productos listos"""
     hash_stock_anterior = request.GET.get('hash_stock', None)
     
     try:
-        resultado = long_polling_meseros(hash_stock_anterior, timeout=25)
+        resultado = await long_polling_meseros(hash_stock_anterior, timeout=25)
         
         # Agregar información específica para meseros sobre productos listos
         if resultado.get('cambios'):
-            # Obtener órdenes del mesero con productos listos
-            ordenes_mesero = Orden.objects.filter(
-                mesero=request.user,
-                estado__in=['EN_PROCESO', 'LISTA']
-            )
-            
-            notificaciones = []
-            for orden in ordenes_mesero:
-                productos_listos = orden.productos_ordenados.filter(estado='LISTO')
-                if productos_listos.exists():
-                    notificaciones.append({
-                        'orden_id': orden.id,
-                        'mesa': orden.mesa.numero,
-                        'productos_listos': [p.producto.nombre for p in productos_listos],
-                        'todos_listos': orden.estado == 'LISTA'
-                    })
-            
-            resultado['notificaciones_mesero'] = notificaciones
+            mesero = await request.auser()
+            resultado['notificaciones_mesero'] = await sync_to_async(_notificaciones_mesero)(mesero)
         
         return JsonResponse(resultado)
     except Exception as e:
@@ -1603,6 +1552,39 @@ def api_longpolling_meseros(request):
         }, status=500)
 
 
+# === EVENTOS SSE (ALTERNATIVA AL LONG POLLING) ===
+
+def _respuesta_sse(eventos):
+    """Respuesta text/event-stream sin buffer intermedio"""
+    respuesta = StreamingHttpResponse(eventos, content_type='text/event-stream')
+    respuesta['X-Accel-Buffering'] = 'no'  # nginx: entregar cada evento al instante
+    return respuesta
+
+
+@never_cache
+@login_required
+async def api_eventos_cocina(request):
+    """Eventos SSE para el dashboard de cocina: un mensaje por cada cambio real"""
+    if not sse_disponible(request):
+        return HttpResponse(status=204)  # EventSource no reconecta: el cliente usa long polling
+    hash_anterior = request.headers.get('Last-Event-ID') or request.GET.get('hash')
+    return _respuesta_sse(eventos_cocina(hash_anterior))
+
+
+@never_cache
+@login_required
+async def api_eventos_meseros(request):
+    """Eventos SSE para meseros: stock, órdenes recientes y productos listos del mesero"""
+    if not sse_disponible(request):
+        return HttpResponse(status=204)
+    hash_stock_anterior = request.headers.get('Last-Event-ID') or request.GET.get('hash_stock')
+    mesero = await request.auser()
+    return _respuesta_sse(eventos_meseros(
+        hash_stock_anterior,
+        datos_extra=lambda: {'notificaciones_mesero': _notificaciones_mesero(mesero)}
+    ))
+
+
 # === SISTEMA Y DEBUG ===
 
 @login_required
@@ -1616,8 +1598,7 @@ def api_estadisticas_sistema(request):
 def api_debug_debounce_status(request):
     """Vista de debugging para ver el estado de debounce del usuario"""
     try:
-        from django.core.cache import cache
-        from ..decorators import DEBOUNCE_CONFIG
+        from ..decorators import DEBOUNCE_DEFAULT_DELAY, generate_debounce_key, debounce_cache
         
         user_id = request.user.id
         acciones_comunes = [
@@ -1631,11 +1612,11 @@ def api_debug_debounce_status(request):
         current_time = time.time()
         
         for accion in acciones_comunes:
-            debounce_key = f"{DEBOUNCE_CONFIG['CACHE_PREFIX']}{user_id}:{accion}"
-            last_request_time = cache.get(debounce_key)
+            debounce_key = generate_debounce_key(user_id, accion)
+            last_request_time = debounce_cache.get(debounce_key)
             
             if last_request_time:
-                tiempo_restante = max(0, DEBOUNCE_CONFIG['DEFAULT_DELAY'] - (current_time - last_request_time))
+                tiempo_restante = max(0, DEBOUNCE_DEFAULT_DELAY - (current_time - last_request_time))
                 estado_debounces[accion] = {
                     'bloqueado': tiempo_restante > 0,
                     'tiempo_restante': tiempo_restante,
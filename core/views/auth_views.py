@@ -12,6 +12,7 @@ from django.contrib.auth.decorators import login_required
 from ..forms import CustomAuthenticationForm
 from ..decorators import group_required
 from ..models import CategoriaProducto, Mesa
+from ..utils import sse_disponible
 
 
 # === VISTAS DE AUTENTICACIÓN ===
@@ -67,14 +68,14 @@ def dashboard_admin(request):
 @group_required(allowed_groups=['Meseros', 'Administradores'])
 def dashboard_mesero(request):
     """Renderiza el panel de control principal para Meseros."""
-    context = {'user': request.user}
+    context = {'user': request.user, 'sse_disponible': sse_disponible(request)}
     return render(request, 'dashboards/mesero_dashboard.html', context)
 
 
 @group_required(allowed_groups=['Cocineros', 'Administradores'])
 def dashboard_cocinero(request):
     """Renderiza el panel de control para Cocineros."""
-    return render(request, 'dashboards/cocinero_dashboard.html')
+    return render(request, 'dashboards/cocinero_dashboard.html', {'sse_disponible': sse_disponible(request)})
 
 
 @group_required(allowed_groups=['Cajeros', 'Administradores'])